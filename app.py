@@ -0,0 +1,208 @@
+"""
+Simple-Agent-Websocket Application Factory
+
+Builds and caches the Flask app and server. This module is all a WSGI
+worker imports; the command line interface lives in main.py.
+"""
+
+import os
+
+# Eventlet hubs that can serve this app; EVENTLET_HUB picks one
+EVENTLET_HUBS = ('epolls', 'kqueue', 'poll', 'selects')
+
+# Monkey patch before anything else imports socket or threading so that
+# Flask-SocketIO runs on eventlet. Set EVENTLET_MONKEY_PATCH=0 to keep
+# standard threads.
+if os.environ.get('EVENTLET_MONKEY_PATCH', '1') == '1':
+    try:
+        import eventlet
+        import eventlet.hubs
+    except ImportError:
+        eventlet = None
+    
+    if eventlet is not None:
+        # The hub must be chosen before patching and before any green thread
+        # (e.g. the logging listener) starts
+        _hub = os.environ.get('EVENTLET_HUB')
+        if _hub:
+            if _hub not in EVENTLET_HUBS:
+                raise RuntimeError(f"EVENTLET_HUB must be one of {', '.join(EVENTLET_HUBS)}, not '{_hub}'")
+            eventlet.hubs.use_hub(_hub)
+        eventlet.monkey_patch()
+
+import sys
+import queue
+import atexit
+import logging
+import logging.handlers
+
+# Emoji in console output must not raise UnicodeEncodeError under ASCII-only
+# locales (e.g. slim containers without LANG set) and hide the real error
+for _stream in (sys.stdout, sys.stderr):
+    if hasattr(_stream, 'reconfigure'):
+        _stream.reconfigure(errors='replace')
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Global app instance for Gunicorn
+app = None
+socketio = None
+
+# Initialized servers keyed by the configuration they were built with
+_servers = {}
+
+# Handler that queues log records, and the background listener that writes them
+_log_handler = None
+_log_listener = None
+
+# Gunicorn worker classes that support WebSocket connections
+ASYNC_WORKER_CLASSES = ('eventlet', 'gevent', 'geventwebsocket')
+
+
+def configure_logging(level=logging.INFO):
+    """
+    Route log records through a queue drained by a background listener,
+    so a slow stdout/stderr pipe never blocks request handling.
+    """
+    global _log_handler
+    
+    if _log_handler is not None:
+        return
+    
+    _log_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    _start_log_listener()
+    atexit.register(_stop_log_listener)
+    # A forked child (main.py --processes) does not inherit the listener thread
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_restart_log_listener)
+    
+    root_logger = logging.getLogger()
+    root_logger.addHandler(_log_handler)
+    root_logger.setLevel(level)
+
+
+def _start_log_listener():
+    """Start a listener writing the records queued by _log_handler to stderr"""
+    global _log_listener
+    
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    _log_listener = logging.handlers.QueueListener(_log_handler.queue, stream_handler)
+    _log_listener.start()
+
+
+def _restart_log_listener():
+    """
+    Give a forked child its own queue and listener.
+    
+    The parent's listener thread does not exist in the child, so records
+    queued there would never be written. A fresh queue also keeps the
+    child's listener apart from the parent's should the listener survive the
+    fork (as a green thread does under eventlet). Records copied from the
+    parent's queue are dropped; the parent writes them.
+    """
+    inherited, _log_handler.queue = _log_handler.queue, queue.SimpleQueue()
+    try:
+        while True:
+            inherited.get_nowait()
+    except queue.Empty:
+        pass
+    _start_log_listener()
+
+
+def _stop_log_listener():
+    """Write out queued records and stop this process's listener"""
+    global _log_listener
+    
+    listener, _log_listener = _log_listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def _gunicorn_worker_class():
+    """Return the worker class given on the gunicorn command line, if any"""
+    args = sys.argv[1:] + os.environ.get('GUNICORN_CMD_ARGS', '').split()
+    for i, arg in enumerate(args):
+        if arg in ('-k', '--worker-class') and i + 1 < len(args):
+            return args[i + 1]
+        if arg.startswith('--worker-class='):
+            return arg.split('=', 1)[1]
+        if arg.startswith('-k') and len(arg) > 2:
+            return arg[2:]
+    return None
+
+
+def _check_worker_class():
+    """Refuse to serve WebSockets from synchronous gunicorn workers"""
+    if 'gunicorn' not in os.path.basename(sys.argv[0]):
+        return
+    
+    worker_class = _gunicorn_worker_class()
+    if worker_class is None:
+        # Falls back to gunicorn.conf.py, which selects eventlet
+        return
+    
+    if not any(name in worker_class for name in ASYNC_WORKER_CLASSES):
+        raise RuntimeError(
+            f"Gunicorn worker class '{worker_class}' cannot serve WebSockets. "
+            "Run with an async worker, e.g. 'gunicorn -k eventlet -w 1 wsgi:app'"
+        )
+
+
+def get_server(host, port, eager_loading=False, **options):
+    """
+    Create and initialize the server once per process and configuration.
+    
+    Extra keyword options are passed through to create_server().
+    """
+    config = (host, port, eager_loading, tuple(sorted(options.items())))
+    server = _servers.get(config)
+    
+    if server is None:
+        from websocket_server.server import create_server
+        
+        configure_logging()
+        
+        server = create_server(host=host, port=port, **options)
+        if not server.initialize(eager_loading=eager_loading):
+            # Failures are not cached so a later call can retry
+            return None
+        
+        _servers[config] = server
+    
+    return server
+
+
+def create_app():
+    """
+    Create and configure the Flask app for production deployment.
+    
+    Tools are always loaded dynamically here (eager_loading=False) so that
+    worker boot time does not grow with the size of the tool registry.
+    
+    Call this in the process that serves requests, e.g. in each gunicorn
+    worker; importing this module monkey patches the process with eventlet
+    and the app starts a logging thread, so it must not be preloaded in the
+    gunicorn master.
+    """
+    global app, socketio
+    
+    if app is None:
+        _check_worker_class()
+        
+        # Create and initialize server instance
+        server = get_server(
+            host='0.0.0.0', 
+            port=int(os.environ.get('PORT', 5000)), 
+            debug=False
+        )
+        if server is None:
+            raise RuntimeError("Failed to initialize server")
+        
+        app = server.app
+        socketio = server.socketio
+        
+        # WSGI runners never call server.run(), so release tools on exit
+        atexit.register(server.cleanup)
+    
+    return app
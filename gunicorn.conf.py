@@ -0,0 +1,22 @@
+"""
+Gunicorn configuration for Simple-Agent-Websocket
+
+Flask-SocketIO needs an async worker, and a single worker unless a message
+queue is configured (SOCKETIO_MESSAGE_QUEUE) and the load balancer keeps
+each client on one worker. Usage: gunicorn wsgi:app
+
+The app is not preloaded: importing app.py monkey patches the process with
+eventlet and create_app() starts a logging thread, and neither may happen
+in the gunicorn master. Each worker builds the app after it is forked.
+"""
+
+import os
+
+# Set GUNICORN_BIND=unix:/run/simple-agent-ws.sock when nginx runs on the same host
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+worker_class = "eventlet"
+# More than one worker requires SOCKETIO_MESSAGE_QUEUE and sticky sessions
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+keepalive = 75
+# Keep eventlet and the app out of the master (see above)
+preload_app = False
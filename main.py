@@ -6,64 +6,167 @@ A lightweight WebSocket wrapper around the SimpleAgent core that provides
 real-time web interface capabilities without duplicating the core codebase.
 """
 
+# Imported first: it monkey patches with eventlet before other imports
+from app import configure_logging, get_server
+
 import argparse
+import json
+import logging
 import os
+import signal
 import sys
 
-from websocket_server.server import create_server
+logger = logging.getLogger(__name__)
 
-# Global app instance for Gunicorn
-app = None
-socketio = None
 
+def _signal_children(child_pids, signum):
+    """Send a signal to the server processes that are still alive"""
+    for pid in child_pids:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
 
-def create_app():
-    """Create and configure the Flask app for production deployment"""
-    global app, socketio
-    
-    if app is None:
-        # Create server instance
-        server = create_server(
-            host='0.0.0.0', 
-            port=int(os.environ.get('PORT', 5000)), 
-            debug=False
-        )
-        
-        # Initialize the server
-        if not server.initialize(eager_loading=False):
-            raise RuntimeError("Failed to initialize server")
-        
-        app = server.app
-        socketio = server.socketio
-    
-    return app
 
+def _reap_children(child_pids, block=False):
+    """Collect exited server processes, waiting for all of them if block is set"""
+    for pid in list(child_pids):
+        try:
+            done, status = os.waitpid(pid, 0 if block else os.WNOHANG)
+        except ChildProcessError:
+            done, status = pid, 0
+        if done:
+            child_pids.remove(pid)
+            if not block:
+                logger.warning("Server process %d exited unexpectedly (status %d)", pid, status)
 
-def main():
-    """Main function to start the WebSocket server"""
+
+def build_parser():
+    """Build the command line argument parser"""
     parser = argparse.ArgumentParser(description='Simple-Agent-Websocket Server')
     parser.add_argument('--host', default='0.0.0.0', help='Host to bind to (default: 0.0.0.0)')
     parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)), 
                       help='Port to bind to (default: PORT env var or 5000)')
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
+    parser.add_argument('--reloader', action='store_true',
+                      help='Restart the server when source files change (threading mode only)')
     parser.add_argument('--eager-loading', action='store_true',
-                      help='Use eager loading (load all tools at startup) instead of dynamic loading')
+                      help='Use eager loading (load all tools at startup) instead of dynamic loading. '
+                           'Not recommended: increases startup time and memory')
+    parser.add_argument('--ws-batch-ms', type=int, default=0,
+                      help='Coalesce agent events sent within this many milliseconds into one '
+                           'event_batch frame (default: 0, batching disabled)')
+    parser.add_argument('--ws-batch-max', type=int, default=140,
+                      help='Flush a batch early once it holds this many events (default: 140)')
+    parser.add_argument('--tcp-nodelay', action=argparse.BooleanOptionalAction, default=True,
+                      help='Disable Nagle\'s algorithm on client connections (default: enabled)')
+    parser.add_argument('--sndbuf', type=int, default=None,
+                      help='SO_SNDBUF size in bytes for client connections (default: kernel default)')
+    parser.add_argument('--rcvbuf', type=int, default=None,
+                      help='SO_RCVBUF size in bytes for client connections (default: kernel default)')
+    parser.add_argument('--max-http-buffer-size', type=int, default=1000000,
+                      help='Largest message in bytes a client may send; bounds per-connection '
+                           'buffering (default: 1000000)')
+    parser.add_argument('--ping-interval', type=int, default=25,
+                      help='Seconds between keepalive pings to each client; raise it to cut idle '
+                           'traffic with many connections (default: 25)')
+    parser.add_argument('--ping-timeout', type=int, default=60,
+                      help='Seconds to wait for a pong before dropping a client (default: 60)')
+    parser.add_argument('--bind-uds', metavar='PATH', default=None,
+                      help='Listen on a Unix domain socket at PATH instead of --host/--port, '
+                           'e.g. behind nginx on the same host (eventlet mode only)')
+    parser.add_argument('--drain-timeout', type=float, default=20,
+                      help='Seconds to wait for running agents on SIGTERM before stopping (default: 20)')
+    parser.add_argument('--profile-startup', metavar='PATH', default=None,
+                      help='Write startup phase timings in milliseconds to PATH as JSON')
+    parser.add_argument('--processes', type=int, default=1,
+                      help='Number of server processes sharing the port via SO_REUSEPORT. Sessions '
+                           'are per process, so clients need sticky routing (default: 1)')
+    return parser
+
+
+def main():
+    """Main function to start the WebSocket server"""
+    args = build_parser().parse_args()
+    configure_logging()
+    
+    if args.eager_loading:
+        logger.warning("--eager-loading imports every tool at startup; this increases startup "
+                       "time and memory. Dynamic loading is the default.")
     
-    args = parser.parse_args()
+    # Create and initialize server; reuses the instance built by create_app()
+    # when the configuration matches. The import inside get_server is
+    # deferred so --help does not load Flask or the core.
+    server = get_server(
+        args.host, args.port,
+        eager_loading=args.eager_loading,
+        debug=args.debug,
+        use_reloader=args.reloader,
+        batch_ms=args.ws_batch_ms,
+        batch_max=args.ws_batch_max,
+        tcp_nodelay=args.tcp_nodelay,
+        sndbuf=args.sndbuf,
+        rcvbuf=args.rcvbuf,
+        reuse_port=args.processes > 1,
+        uds_path=args.bind_uds,
+        max_http_buffer_size=args.max_http_buffer_size,
+        ping_interval=args.ping_interval,
+        ping_timeout=args.ping_timeout
+    )
+    
+    if server is None:
+        logger.critical("Failed to initialize server")
+        sys.exit(1)
     
-    # Create and initialize server
-    server = create_server(host=args.host, port=args.port, debug=args.debug)
+    if args.profile_startup:
+        with open(args.profile_startup, 'w') as f:
+            json.dump({
+                'total_ms': sum(server.startup_timings.values()),
+                'phases_ms': server.startup_timings
+            }, f, indent=2)
     
-    if not server.initialize(eager_loading=args.eager_loading):
-        print("❌ Failed to initialize server")
+    if args.bind_uds and server.socketio.async_mode != 'eventlet':
+        logger.error("--bind-uds requires eventlet mode")
         sys.exit(1)
     
+    child_pids = []
+    if args.processes > 1:
+        if server.socketio.async_mode != 'eventlet':
+            logger.error("--processes requires eventlet mode")
+            sys.exit(1)
+        if args.bind_uds:
+            logger.error("--processes cannot be combined with --bind-uds")
+            sys.exit(1)
+        
+        # Fork after initialization so workers share the loaded core
+        for _ in range(args.processes - 1):
+            pid = os.fork()
+            if pid == 0:
+                child_pids = []  # Only the first process manages the others
+                break
+            child_pids.append(pid)
+    
+    # Drain running agents and flush batched events on SIGTERM, in every process
+    def handle_sigterm(*_):
+        if child_pids:
+            # The others now exit on purpose; reap them in the finally below
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            _signal_children(child_pids, signal.SIGTERM)
+        server.shutdown(args.drain_timeout)
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    if child_pids:
+        signal.signal(signal.SIGCHLD, lambda *_: _reap_children(child_pids))
+    
     # Run the server
-    server.run()
-
+    try:
+        server.run()
+    finally:
+        # However the first process stops, the others stop with it
+        if child_pids:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            _signal_children(child_pids, signal.SIGTERM)
+            _reap_children(child_pids, block=True)
 
-# Create app instance for Gunicorn
-app = create_app()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,73 @@
+"""Shared fixtures: a stand-in for the SimpleAgent core and a recording Socket.IO server"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from websocket_server.core_loader import core_loader
+
+
+class FakeSocketIO:
+    """Records emits; background tasks are queued until run_tasks() is called"""
+
+    async_mode = 'threading'
+
+    def __init__(self):
+        self.emitted = []
+        self.tasks = []
+
+    def emit(self, event, data, room=None, **kwargs):
+        self.emitted.append((event, data, room))
+
+    def start_background_task(self, target, *args, **kwargs):
+        self.tasks.append((target, args, kwargs))
+
+    def sleep(self, seconds=0):
+        pass
+
+    def run_tasks(self):
+        tasks, self.tasks = self.tasks, []
+        for target, args, kwargs in tasks:
+            target(*args, **kwargs)
+
+    def events(self, name):
+        return [data for event, data, room in self.emitted if event == name]
+
+
+@pytest.fixture
+def socketio():
+    return FakeSocketIO()
+
+
+@pytest.fixture
+def core(monkeypatch):
+    """
+    Replace the core modules with a minimal RunManager.
+
+    Tests hook into it by setting core.on_init(run_manager) and
+    core.on_run(run_manager).
+    """
+    core = SimpleNamespace(DEFAULT_MODEL='test-model', AGENT_VERSION='1.0.0',
+                           on_init=None, on_run=None)
+
+    class RunManager:
+        def __init__(self, model, output_dir):
+            self.output_dir = output_dir
+            self.conversation_manager = SimpleNamespace()
+            self.execution_manager = SimpleNamespace(
+                stop_requested=False,
+                execute_function=lambda name, args: ('', None),
+                get_next_action=lambda history: {'role': 'assistant', 'content': None},
+            )
+            self.memory_manager = SimpleNamespace()
+            self.summarizer = SimpleNamespace()
+            if core.on_init:
+                core.on_init(self)
+
+        def run(self, instruction, max_steps, auto_continue):
+            if core.on_run:
+                core.on_run(self)
+
+    core.RunManager = RunManager
+    monkeypatch.setattr(core_loader, 'load_core_modules', lambda: core)
+    return core
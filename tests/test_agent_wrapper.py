@@ -0,0 +1,107 @@
+"""Tests for the agent wrapper module"""
+
+import time
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from websocket_server.agent_wrapper import (
+    WebSocketAgentWrapper, SessionEntry, SessionManager, RunInProgressError, RunLimitError
+)
+
+
+def test_stop_before_run_manager_exists_still_stops_run(core, socketio, tmp_path):
+    """A stop that lands while the run manager is being built reaches the run"""
+    wrapper = WebSocketAgentWrapper('sid', str(tmp_path))
+    seen = {}
+    # The core run manager is built inside WebSocketRunManager(), before
+    # the wrapper can hand the stop on
+    core.on_init = lambda run_manager: wrapper.stop()
+    core.on_run = lambda run_manager: seen.update(
+        stopped=run_manager.execution_manager.stop_requested)
+
+    wrapper.run_async('do it', socketio_instance=socketio)
+
+    assert seen['stopped'] is True
+    assert wrapper.run_manager.stop_requested
+    assert socketio.events('agent_stopped')
+    assert not socketio.events('agent_finished')
+
+
+def test_stop_reaches_each_new_run(core, socketio, tmp_path):
+    """A stop requested for one run does not swallow stops for the next"""
+    wrapper = WebSocketAgentWrapper('sid', str(tmp_path))
+    core.on_run = lambda run_manager: wrapper.stop()
+
+    wrapper.run_async('first', socketio_instance=socketio)
+    wrapper.run_async('second', socketio_instance=socketio)
+
+    assert len(socketio.events('agent_stopped')) == 2
+    assert wrapper.run_manager.execution_manager.stop_requested
+
+
+def test_stop_cancels_pending_prompt_without_answering(core, socketio, tmp_path):
+    """Stopping a run that waits for input does not feed the core an answer"""
+    wrapper = WebSocketAgentWrapper('sid', str(tmp_path))
+    answers = []
+    core.on_run = lambda run_manager: answers.append(input('Continue? '))
+
+    thread = threading.Thread(target=wrapper.run_async, args=('do it',),
+                              kwargs={'socketio_instance': socketio})
+    thread.start()
+    deadline = time.monotonic() + 5
+    while not socketio.events('waiting_for_input') and time.monotonic() < deadline:
+        time.sleep(0.01)
+    wrapper.stop()
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert answers == []
+    assert socketio.events('agent_stopped')
+    assert not socketio.events('execution_error')
+
+
+def _add_session(manager, session_id, tmp_path):
+    wrapper = WebSocketAgentWrapper(session_id, str(tmp_path))
+    session_data = manager.sessions[session_id] = SessionEntry(wrapper, str(tmp_path), 'now')
+    return session_data
+
+
+def test_reserve_run_enforces_limit_for_concurrent_requests(tmp_path):
+    """Run requests arriving together never exceed the run limit"""
+    manager = SessionManager()
+    sessions = [_add_session(manager, f'sid{i}', tmp_path) for i in range(20)]
+    barrier = threading.Barrier(len(sessions))
+    outcomes = []
+    
+    def request_run(session_data):
+        barrier.wait()
+        try:
+            manager.reserve_run(session_data, Future(), max_runs=3)
+            outcomes.append('reserved')
+        except RunLimitError:
+            outcomes.append('busy')
+    
+    threads = [threading.Thread(target=request_run, args=(session_data,)) for session_data in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    
+    assert outcomes.count('reserved') == 3
+    assert manager.count_active_runs() == 3
+
+
+def test_reserve_run_refuses_second_run_for_session(tmp_path):
+    """A session with a pending run cannot reserve another; a finished one can"""
+    manager = SessionManager()
+    session_data = _add_session(manager, 'sid', tmp_path)
+    first = Future()
+    manager.reserve_run(session_data, first, max_runs=10)
+    
+    with pytest.raises(RunInProgressError):
+        manager.reserve_run(session_data, Future(), max_runs=10)
+    
+    first.cancel()
+    manager.reserve_run(session_data, Future(), max_runs=10)
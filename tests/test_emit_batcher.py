@@ -0,0 +1,88 @@
+"""Tests for the emit batcher module"""
+
+from websocket_server.emit_batcher import EmitBatcher
+
+
+def test_single_event_is_sent_unchanged_after_interval(socketio):
+    """A lone event waits for the interval and then goes out as itself"""
+    batcher = EmitBatcher(socketio, batch_ms=50)
+    batcher.emit('step_start', {'step': 1}, room='a')
+
+    assert socketio.emitted == []
+    socketio.run_tasks()
+    assert socketio.emitted == [('step_start', {'step': 1}, 'a')]
+
+
+def test_events_are_framed_as_one_batch_in_order(socketio):
+    """Several events for a room go out as one event_batch, in emission order"""
+    batcher = EmitBatcher(socketio)
+    batcher.emit('step_start', {'step': 1}, room='a')
+    batcher.emit('assistant_message', {'content': 'hi'}, room='a')
+    socketio.run_tasks()
+
+    assert socketio.emitted == [('event_batch', {'events': [
+        {'event': 'step_start', 'data': {'step': 1}},
+        {'event': 'assistant_message', 'data': {'content': 'hi'}},
+    ]}, 'a')]
+
+
+def test_full_batch_is_flushed_without_waiting(socketio):
+    """Reaching batch_max sends the batch at once; later events start a new one"""
+    batcher = EmitBatcher(socketio, batch_max=3)
+    for step in range(4):
+        batcher.emit('step_start', {'step': step}, room='a')
+
+    assert len(socketio.emitted) == 1
+    event, data, room = socketio.emitted[0]
+    assert (event, room) == ('event_batch', 'a')
+    assert [entry['data']['step'] for entry in data['events']] == [0, 1, 2]
+
+    socketio.run_tasks()
+    assert socketio.emitted[1:] == [('step_start', {'step': 3}, 'a')]
+
+
+def test_rooms_are_batched_separately(socketio):
+    """Events for one room never end up in another room's batch"""
+    batcher = EmitBatcher(socketio)
+    batcher.emit('step_start', {'step': 1}, room='a')
+    batcher.emit('step_start', {'step': 2}, room='b')
+    batcher.emit('step_start', {'step': 3}, room='a')
+    socketio.run_tasks()
+
+    by_room = {room: (event, data) for event, data, room in socketio.emitted}
+    assert len(socketio.emitted) == 2
+    assert by_room['b'] == ('step_start', {'step': 2})
+    assert by_room['a'][0] == 'event_batch'
+    assert [entry['data']['step'] for entry in by_room['a'][1]['events']] == [1, 3]
+
+
+def test_discard_drops_pending_events(socketio):
+    """Events pending for a discarded room are never sent"""
+    batcher = EmitBatcher(socketio)
+    batcher.emit('step_start', {'step': 1}, room='a')
+    batcher.emit('step_start', {'step': 1}, room='b')
+    batcher.discard('a')
+    socketio.run_tasks()
+
+    assert socketio.emitted == [('step_start', {'step': 1}, 'b')]
+
+
+def test_flush_all_sends_every_room(socketio):
+    """flush_all() sends pending events without waiting for the interval"""
+    batcher = EmitBatcher(socketio)
+    batcher.emit('step_start', {'step': 1}, room='a')
+    batcher.emit('step_start', {'step': 2}, room='b')
+    batcher.flush_all()
+
+    assert sorted(room for _, _, room in socketio.emitted) == ['a', 'b']
+    socketio.run_tasks()
+    assert len(socketio.emitted) == 2
+
+
+def test_broadcasts_are_not_batched(socketio):
+    """Emits without a room, or with extra options, go straight through"""
+    batcher = EmitBatcher(socketio)
+    batcher.emit('server_notice', {'text': 'hi'})
+
+    assert socketio.emitted == [('server_notice', {'text': 'hi'}, None)]
+    assert socketio.tasks == []
@@ -0,0 +1,70 @@
+"""Tests for the JSON codec module"""
+
+import json
+import math
+import uuid
+import dataclasses
+from datetime import date, datetime, timezone
+
+import pytest
+from flask import Flask, jsonify
+from flask.json.provider import DefaultJSONProvider
+
+from websocket_server import json_codec
+
+
+@dataclasses.dataclass
+class FileRecord:
+    name: str
+    modified: datetime
+
+
+PAYLOAD = {
+    'session_id': 'abc',
+    'started': datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+    'day': date(2024, 5, 1),
+    'file': FileRecord('out.txt', datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)),
+    'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+    'count': 3,
+}
+
+
+def _jsonify(provider_class, debug):
+    app = Flask(__name__)
+    app.debug = debug
+    app.json = provider_class(app)
+    with app.app_context():
+        return jsonify(PAYLOAD).get_data(as_text=True)
+
+
+@pytest.mark.parametrize('debug', [False, True])
+def test_provider_matches_flask_default(debug):
+    """Responses are byte for byte those of Flask's default provider"""
+    assert _jsonify(json_codec.JSONProvider, debug) == _jsonify(DefaultJSONProvider, debug)
+
+
+def test_dumps_stringifies_non_str_keys_like_stdlib():
+    """Non-str dict keys become the same strings the standard library writes"""
+    obj = {1: 'a', 2.5: 'b', None: 'c', 'x': {True: 'd'}}
+
+    assert json_codec.dumps(obj) == json.dumps(obj, separators=(',', ':'))
+
+
+def test_dumps_falls_back_to_stdlib_for_payloads_orjson_rejects():
+    """Integers beyond 64 bits are encoded by the standard library"""
+    obj = {'big': 2 ** 70}
+
+    assert json_codec.dumps(obj) == '{"big":1180591620717411303424}'
+
+
+def test_dumps_honours_stdlib_options():
+    """Options orjson has no equivalent for are passed to the standard library"""
+    obj = {'when': date(2024, 5, 1)}
+
+    assert json_codec.dumps(obj, default=str) == '{"when": "2024-05-01"}'
+
+
+@pytest.mark.skipif(json_codec.orjson is None, reason="orjson is not installed")
+def test_dumps_writes_non_finite_floats_as_null():
+    """NaN and infinities are written as null, as documented"""
+    assert json_codec.dumps([math.nan, math.inf, -math.inf]) == '[null,null,null]'
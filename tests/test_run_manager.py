@@ -0,0 +1,204 @@
+"""Tests for the WebSocket run manager module"""
+
+import json
+import time
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import websocket_server.run_manager as run_manager_module
+from websocket_server.run_manager import WebSocketRunManager, _remove_orphaned_tool_messages
+
+
+@pytest.fixture
+def run_manager(core, socketio, tmp_path):
+    return WebSocketRunManager('test-model', str(tmp_path), 'sid', socketio)
+
+
+def test_print_marker_priority_is_kept_for_lines_with_two_markers(run_manager, socketio):
+    """A step marker wins over an earlier warning marker in the same line"""
+    run_manager.handle_print(("⚠️ retrying --- Step 2/10",))
+
+    assert [(data['step'], data['max_steps']) for data in socketio.events('step_start')] == [(2, 10)]
+    assert socketio.events('warning') == []
+
+
+def test_print_marker_single_warning(run_manager, socketio):
+    """A line with one marker goes to that marker's handler"""
+    run_manager.handle_print(("⚠️ disk almost full",))
+
+    assert [data['message'] for data in socketio.events('warning')] == ["⚠️ disk almost full"]
+
+
+def _in_thread(target):
+    """Run target on a new thread and return what it returned or raised"""
+    outcome = []
+    
+    def call():
+        try:
+            outcome.append(target())
+        except BaseException as e:
+            outcome.append(e)
+    
+    thread = threading.Thread(target=call)
+    thread.start()
+    thread.join(5)
+    return outcome[0]
+
+
+def test_worker_thread_output_goes_to_sole_active_run(core, run_manager, socketio):
+    """print() and input() on a thread the run started reach the run's client"""
+    answers = []
+    
+    def core_run(_):
+        worker = threading.Thread(target=lambda: answers.append(input('Continue? ')))
+        worker.start()
+        deadline = time.monotonic() + 5
+        while not run_manager.waiting_for_input and time.monotonic() < deadline:
+            time.sleep(0.01)
+        run_manager.provide_user_input('yes')
+        worker.join(5)
+        _in_thread(lambda: print("✅ Task completed"))
+    
+    core.on_run = core_run
+    run_manager.run('do it')
+    
+    assert answers == ['yes']
+    assert socketio.events('task_completed')
+
+
+def test_worker_thread_input_refused_with_several_runs(monkeypatch):
+    """input() on an unregistered thread does not read stdin while runs are active"""
+    run_manager_module._install_builtin_hooks()
+    monkeypatch.setattr(run_manager_module, '_active_runs', {object(), object()})
+    
+    outcome = _in_thread(lambda: input('Continue? '))
+    
+    assert type(outcome) is EOFError
+
+
+def _dict_message(role, content=None, tool_calls=None, tool_call_id=None):
+    message = {'role': role, 'content': content}
+    if tool_calls is not None:
+        message['tool_calls'] = [{'id': call_id, 'type': 'function'} for call_id in tool_calls]
+    if tool_call_id is not None:
+        message['tool_call_id'] = tool_call_id
+    return message
+
+
+def _object_message(role, content=None, tool_calls=None, tool_call_id=None):
+    if tool_calls is not None:
+        tool_calls = [SimpleNamespace(id=call_id, type='function') for call_id in tool_calls]
+    return SimpleNamespace(role=role, content=content, tool_calls=tool_calls, tool_call_id=tool_call_id)
+
+
+def _field(message, name):
+    return message.get(name) if isinstance(message, dict) else getattr(message, name)
+
+
+@pytest.fixture(params=[_dict_message, _object_message], ids=['dict', 'object'])
+def message(request):
+    return request.param
+
+
+def test_orphan_removal_keeps_complete_history_untouched(message):
+    """A history where every call has its result is left as it is"""
+    history = [
+        message('user', 'list files'),
+        message('assistant', 'Looking', tool_calls=['a', 'b']),
+        message('tool', 'x.txt', tool_call_id='a'),
+        message('tool', 'y.txt', tool_call_id='b'),
+        message('assistant', 'Done'),
+    ]
+    snapshot = list(history)
+    
+    assert _remove_orphaned_tool_messages(history) == 0
+    assert history == snapshot
+    assert all(kept is original for kept, original in zip(history, snapshot))
+
+
+def test_orphan_removal_drops_result_without_call(message):
+    """A tool result whose call is not in the history is removed, in place"""
+    history = [
+        message('user', 'list files'),
+        message('tool', 'x.txt', tool_call_id='gone'),
+        message('assistant', 'Done'),
+    ]
+    history_list = history
+    
+    assert _remove_orphaned_tool_messages(history) == 1
+    assert history is history_list
+    assert [_field(m, 'role') for m in history] == ['user', 'assistant']
+
+
+def test_orphan_removal_keeps_text_of_turn_with_partial_results(message):
+    """Calls without all their results are dropped, the assistant's text stays"""
+    history = [
+        message('user', 'list files'),
+        message('assistant', 'Looking', tool_calls=['a', 'b']),
+        message('tool', 'x.txt', tool_call_id='a'),
+        message('user', 'stop'),
+    ]
+    
+    assert _remove_orphaned_tool_messages(history) == 2
+    assert [_field(m, 'role') for m in history] == ['user', 'assistant', 'user']
+    assistant = history[1]
+    assert _field(assistant, 'content') == 'Looking'
+    assert not _field(assistant, 'tool_calls')
+
+
+def test_orphan_removal_drops_turn_with_no_text(message):
+    """An assistant turn with only unmatched tool calls has nothing left to keep"""
+    history = [
+        message('user', 'list files'),
+        message('assistant', None, tool_calls=['a']),
+    ]
+    
+    assert _remove_orphaned_tool_messages(history) == 1
+    assert [_field(m, 'role') for m in history] == ['user']
+
+
+def _record_files(run_manager, output_dir, names):
+    """Create and record files one scan at a time, so they are recorded in order"""
+    for name in names:
+        (output_dir / name).write_text(name)
+        run_manager._scan_for_new_files()
+
+
+def _names(files):
+    return [file_info['name'] for file_info in files]
+
+
+def test_created_files_cursor_survives_trim(run_manager, tmp_path, monkeypatch):
+    """Files after the cursor are returned exactly once, across trims"""
+    monkeypatch.setattr(run_manager_module, 'MAX_TRACKED_FILES', 5)
+    _record_files(run_manager, tmp_path, ['f0', 'f1', 'f2'])
+    
+    files, cursor = run_manager.get_created_files_since(0)
+    assert (_names(files), cursor) == (['f0', 'f1', 'f2'], 3)
+    
+    _record_files(run_manager, tmp_path, ['f3', 'f4', 'f5', 'f6'])
+    assert _names(run_manager.created_files) == ['f2', 'f3', 'f4', 'f5', 'f6']
+    
+    files, next_cursor = run_manager.get_created_files_since(cursor)
+    assert (_names(files), next_cursor) == (['f3', 'f4', 'f5', 'f6'], 7)
+    assert run_manager.get_created_files_since(next_cursor) == ([], 7)
+    # A cursor from before the trim gets every file still kept
+    files, _ = run_manager.get_created_files_since(1)
+    assert _names(files) == ['f2', 'f3', 'f4', 'f5', 'f6']
+
+
+def test_created_files_json_is_rebuilt_after_trim(run_manager, tmp_path, monkeypatch):
+    """The cached JSON follows the file list, even when a trim keeps its length"""
+    monkeypatch.setattr(run_manager_module, 'MAX_TRACKED_FILES', 3)
+    _record_files(run_manager, tmp_path, ['f0', 'f1', 'f2'])
+    
+    encoded, count = run_manager.get_created_files_json()
+    assert (_names(json.loads(encoded)), count) == (['f0', 'f1', 'f2'], 3)
+    assert run_manager.get_created_files_json()[0] is encoded
+    
+    _record_files(run_manager, tmp_path, ['f3'])
+    encoded, count = run_manager.get_created_files_json()
+    assert (_names(json.loads(encoded)), count) == (['f1', 'f2', 'f3'], 3)
+    assert json.loads(encoded) == run_manager.created_files
@@ -0,0 +1,80 @@
+"""Tests for the WebSocket server module"""
+
+import os
+import sys
+import time
+import socket
+import textwrap
+import threading
+import subprocess
+import urllib.request
+from types import SimpleNamespace
+
+from werkzeug.serving import make_server
+
+import websocket_server.server as server_module
+from websocket_server.server import SimpleAgentWebSocketServer
+
+
+def _hello_app(environ, start_response):
+    sock = environ['werkzeug.socket']
+    nodelay = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'nodelay=%d' % bool(nodelay)]
+
+
+def test_request_handler_serves_and_tunes_connection():
+    """The threading-mode request handler serves requests with TCP_NODELAY set"""
+    server = SimpleAgentWebSocketServer(tcp_nodelay=True)
+    httpd = make_server('127.0.0.1', 0, _hello_app, threaded=True,
+                        request_handler=server._make_request_handler())
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = f"http://127.0.0.1:{httpd.server_port}/health"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert response.status == 200
+            assert response.read() == b'nodelay=1'
+    finally:
+        httpd.shutdown()
+        thread.join(5)
+
+
+def _server_with_cleanup(cleanup, async_mode):
+    server = SimpleAgentWebSocketServer()
+    server.core = SimpleNamespace(commands=SimpleNamespace(cleanup=cleanup))
+    server.socketio = SimpleNamespace(async_mode=async_mode)
+    return server
+
+
+def test_cleanup_gives_up_on_stuck_tool(monkeypatch):
+    """cleanup() returns after CLEANUP_TIMEOUT even if the tool cleanup never does"""
+    monkeypatch.setattr(server_module, 'CLEANUP_TIMEOUT', 0.2)
+    never = threading.Event()
+    server = _server_with_cleanup(never.wait, 'threading')
+    
+    start = time.monotonic()
+    server.cleanup()
+    assert time.monotonic() - start < 5
+
+
+def test_cleanup_gives_up_on_stuck_tool_under_eventlet():
+    """A tool blocked in a call that does not yield cannot hold up cleanup() under eventlet"""
+    script = textwrap.dedent("""
+        import eventlet
+        eventlet.monkey_patch()
+        from types import SimpleNamespace
+        from eventlet.patcher import original
+        import websocket_server.server as server_module
+        
+        server_module.CLEANUP_TIMEOUT = 0.2
+        server = server_module.SimpleAgentWebSocketServer()
+        blocking_sleep = original('time').sleep
+        server.core = SimpleNamespace(commands=SimpleNamespace(cleanup=lambda: blocking_sleep(3600)))
+        server.socketio = SimpleNamespace(async_mode='eventlet')
+        server.cleanup()
+    """)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', script], cwd=root, timeout=30,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,87 @@
+"""Tests for the timestamps module"""
+
+import time
+from types import SimpleNamespace
+from datetime import datetime
+
+import pytest
+
+from websocket_server import timestamps
+from websocket_server.timestamps import iso_from_ns, now_iso
+
+SECOND = 1_000_000_000
+MICROSECOND = 1_000
+
+# A second boundary, 2024-03-01 00:00:00 UTC
+BOUNDARY = 1_709_251_200 * SECOND
+
+
+@pytest.fixture(autouse=True)
+def empty_caches(monkeypatch):
+    monkeypatch.setattr(timestamps, '_second_cache', (None, ''))
+    monkeypatch.setattr(timestamps, '_cache', (-timestamps.TIMESTAMP_RESOLUTION_NS, ''))
+
+
+def _expected(timestamp_ns):
+    return datetime.fromtimestamp(timestamp_ns / 1e9).isoformat()
+
+
+def test_iso_from_ns_matches_isoformat_across_second_boundaries():
+    """Formatting in any order across seconds matches datetime, cache or not"""
+    values = [
+        BOUNDARY - MICROSECOND,
+        BOUNDARY,
+        BOUNDARY + MICROSECOND,
+        BOUNDARY - MICROSECOND,
+        BOUNDARY + 999_999 * MICROSECOND,
+        BOUNDARY + SECOND,
+        BOUNDARY + SECOND + 500_000 * MICROSECOND,
+        BOUNDARY + 86_400 * SECOND + 123_456 * MICROSECOND,
+    ]
+    for value in values:
+        assert iso_from_ns(value) == _expected(value), value
+
+
+def test_iso_from_ns_omits_zero_fraction_like_isoformat():
+    """Whole seconds have no fractional part, as with isoformat()"""
+    assert iso_from_ns(BOUNDARY) == _expected(BOUNDARY)
+    assert '.' not in iso_from_ns(BOUNDARY)
+    # Less than a microsecond past the second also counts as whole
+    assert iso_from_ns(BOUNDARY + 999) == _expected(BOUNDARY)
+
+
+def test_iso_from_ns_truncates_to_microseconds():
+    """Sub-microsecond digits are dropped, not rounded"""
+    value = BOUNDARY + 123_456 * MICROSECOND + 999
+    assert iso_from_ns(value) == _expected(BOUNDARY + 123_456 * MICROSECOND)
+
+
+def test_now_iso_is_current_local_time():
+    """now_iso() parses as a local time between the clock readings around it"""
+    before = datetime.now()
+    stamp = now_iso()
+    after = datetime.now()
+
+    assert before.replace(microsecond=0) <= datetime.fromisoformat(stamp) <= after
+
+
+def test_now_iso_reuses_string_within_resolution(monkeypatch):
+    """Calls within TIMESTAMP_RESOLUTION_NS share one string; later calls format anew"""
+    clock = {'monotonic': 10 * SECOND, 'wall': BOUNDARY + 250_000 * MICROSECOND}
+    monkeypatch.setattr(timestamps, 'time', SimpleNamespace(
+        monotonic_ns=lambda: clock['monotonic'],
+        time_ns=lambda: clock['wall'],
+        strftime=time.strftime,
+        localtime=time.localtime,
+    ))
+
+    first = now_iso()
+    assert first == _expected(clock['wall'])
+
+    clock['monotonic'] += timestamps.TIMESTAMP_RESOLUTION_NS - 1
+    clock['wall'] += timestamps.TIMESTAMP_RESOLUTION_NS - 1
+    assert now_iso() is first
+
+    clock['monotonic'] += 1
+    clock['wall'] = BOUNDARY + SECOND + 250_000 * MICROSECOND
+    assert now_iso() == _expected(clock['wall'])
@@ -6,22 +6,46 @@ Manages agent sessions and threading.
 """
 
 import os
-import uuid
 import logging
+import secrets
 import threading
-from datetime import datetime
 
 from .core_loader import core_loader
 from .run_manager import WebSocketRunManager
+from .timestamps import now_iso
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on concurrently connected sessions
+MAX_SESSIONS = int(os.environ.get('MAX_SESSIONS', 1000))
+
+# Root for per-session output directories, resolved once against the
+# startup working directory
+_BASE_OUTPUT_DIR = os.path.abspath('output')
+
+
+class SessionLimitError(RuntimeError):
+    """Raised when a new session would exceed MAX_SESSIONS"""
+
+
+class RunInProgressError(RuntimeError):
+    """Raised when a session that already has an agent run asks for another"""
+
+
+class RunLimitError(RuntimeError):
+    """Raised when a new agent run would exceed the server's run limit"""
+
 
 class WebSocketAgentWrapper:
     """
     Wrapper class that adapts SimpleAgent for WebSocket communication.
     """
     
+    __slots__ = (
+        'session_id', 'output_dir', 'model', 'is_running',
+        'stop_requested', 'run_manager', 'released'
+    )
+    
     def __init__(self, session_id: str, output_dir: str, model: str = None):
         self.session_id = session_id
         self.output_dir = output_dir
@@ -29,70 +53,130 @@ class WebSocketAgentWrapper:
         self.is_running = False
         self.stop_requested = False
         self.run_manager = None
+        self.released = False
         
     def run_async(self, instruction: str, max_steps: int = 10, auto_continue: int = 0, socketio_instance=None):
         """Run the agent asynchronously and emit progress updates"""
-        self.is_running = True
+        # Clear the flag before the run is visible, so a stop seen as
+        # running is never reset
         self.stop_requested = False
+        self.is_running = True
         
         try:
             # Create WebSocket-enabled run manager
-            self.run_manager = WebSocketRunManager(
+            run_manager = WebSocketRunManager(
                 model=self.model,
                 output_dir=self.output_dir,
                 session_id=self.session_id,
                 socketio_instance=socketio_instance
             )
+            self.run_manager = run_manager
+            
+            # A stop that arrived while the run manager was being built
+            # could not reach it
+            if self.stop_requested:
+                self._forward_stop(run_manager)
             
             # Run the agent
-            self.run_manager.run(instruction, max_steps, auto_continue)
+            run_manager.run(instruction, max_steps, auto_continue)
             
         except Exception as e:
             logger.error(f"Error in agent execution: {e}")
             if socketio_instance:
                 socketio_instance.emit('agent_error', {
                     'error': str(e),
-                    'timestamp': datetime.now().isoformat()
+                    'timestamp': now_iso()
                 }, room=self.session_id)
         finally:
             self.is_running = False
+            if self.released:
+                self._release_run_manager()
     
     def stop(self):
-        """Request the agent to stop"""
+        """Request the agent to stop; repeated requests for the same run are no-ops"""
         self.stop_requested = True
-        if self.run_manager:
-            self.run_manager.stop_requested = True
-            if hasattr(self.run_manager, 'execution_manager'):
-                self.run_manager.execution_manager.stop_requested = True
+        
+        run_manager = self.run_manager
+        if run_manager is not None and not run_manager.stop_requested:
+            self._forward_stop(run_manager)
         return True
+    
+    def _forward_stop(self, run_manager):
+        """Pass a stop request on to a run manager and its execution manager"""
+        run_manager.stop_requested = True
+        execution_manager = getattr(run_manager, 'execution_manager', None)
+        if execution_manager is not None:
+            execution_manager.stop_requested = True
+        # Wake a pending prompt so the run does not wait out the input timeout
+        run_manager.cancel_input()
+        
+    def release(self):
+        """
+        Drop per-run state after the session is removed.
+        
+        If an agent is still running, this happens when it exits.
+        """
+        self.released = True
+        if not self.is_running:
+            self._release_run_manager()
+            
+    def _release_run_manager(self):
+        """Unhook and drop the run manager so its buffers can be reclaimed"""
+        run_manager, self.run_manager = self.run_manager, None
+        if run_manager:
+            run_manager.close()
         
     def provide_user_input(self, user_input: str):
         """Provide user input to the running agent"""
-        if self.run_manager and self.is_running:
-            self.run_manager.provide_user_input(user_input)
+        run_manager = self.run_manager
+        if run_manager is not None and self.is_running:
+            run_manager.provide_user_input(user_input)
+
+
+class SessionEntry:
+    """Bookkeeping for one connected session"""
+    
+    __slots__ = ('wrapper', 'output_dir', 'real_output_dir', 'connected_at', 'future')
+    
+    def __init__(self, wrapper: WebSocketAgentWrapper, output_dir: str, connected_at: str):
+        self.wrapper = wrapper
+        self.output_dir = output_dir
+        self.real_output_dir = os.path.realpath(output_dir)  # Symlinks resolved, for containment checks
+        self.connected_at = connected_at
+        self.future = None  # Pending or running agent job (pool job or background task)
 
 
 class SessionManager:
-    """Manages WebSocket agent sessions"""
+    """
+    Manages WebSocket agent sessions.
+    
+    Writes are serialized by a lock; readers iterate over snapshots so they
+    never see the dict change size mid-iteration.
+    """
     
     def __init__(self):
         self.sessions = {}
+        self._lock = threading.Lock()
+        self._version_folder = None  # e.g. 'v1_2_3', built on first session
         
     def create_session(self, session_id: str, model: str = None):
         """Create a new agent session"""
+        if len(self.sessions) >= MAX_SESSIONS:
+            raise SessionLimitError(f"Server is at its limit of {MAX_SESSIONS} sessions")
+        
         # Load core modules to get version info
         core = core_loader.load_core_modules()
-        AGENT_VERSION = core['AGENT_VERSION']
-        DEFAULT_MODEL = core['DEFAULT_MODEL']
+        DEFAULT_MODEL = core.DEFAULT_MODEL
         
-        # Create a unique output directory for this session
-        base_output_dir = os.path.abspath('output')
-        if not os.path.exists(base_output_dir):
-            os.makedirs(base_output_dir)
+        # The agent version is fixed once the core is loaded
+        version_folder = self._version_folder
+        if version_folder is None:
+            version_folder = self._version_folder = 'v' + core.AGENT_VERSION.lstrip('v').replace('.', '_')
         
-        run_id = str(uuid.uuid4())[:8]
-        version_folder = 'v' + '_'.join(AGENT_VERSION.lstrip('v').split('.'))
-        session_output_dir = os.path.join(base_output_dir, f"{version_folder}_{session_id}_{run_id}")
+        # Create a unique output directory for this session; makedirs also
+        # creates the base directory on first use
+        run_id = secrets.token_hex(4)
+        session_output_dir = os.path.join(_BASE_OUTPUT_DIR, f"{version_folder}_{session_id}_{run_id}")
         os.makedirs(session_output_dir, exist_ok=True)
         
         # Initialize agent wrapper for this session
@@ -103,14 +187,22 @@ class SessionManager:
         )
         
         # Store session data
-        self.sessions[session_id] = {
-            'wrapper': wrapper,
-            'output_dir': session_output_dir,
-            'connected_at': datetime.now().isoformat()
-        }
+        session_data = SessionEntry(
+            wrapper=wrapper,
+            output_dir=session_output_dir,
+            connected_at=now_iso()
+        )
+        with self._lock:
+            rejected = len(self.sessions) >= MAX_SESSIONS
+            if not rejected:
+                self.sessions[session_id] = session_data
+        if rejected:
+            # Do not leave a directory behind for every refused connection
+            os.rmdir(session_output_dir)
+            raise SessionLimitError(f"Server is at its limit of {MAX_SESSIONS} sessions")
         
-        logger.info(f"Created session {session_id} with output dir: {session_output_dir}")
-        return self.sessions[session_id]
+        logger.info("Created session %s with output dir: %s", session_id, session_output_dir)
+        return session_data
         
     def get_session(self, session_id: str):
         """Get an existing session"""
@@ -118,27 +210,62 @@ class SessionManager:
         
     def remove_session(self, session_id: str):
         """Remove a session"""
-        if session_id in self.sessions:
-            session_data = self.sessions[session_id]
-            wrapper = session_data['wrapper']
+        with self._lock:
+            session_data = self.sessions.pop(session_id, None)
+        
+        if session_data:
+            wrapper = session_data.wrapper
             
-            # Stop any running agent
+            # Stop any running agent and drop a run still waiting for a worker
             if wrapper.is_running:
                 wrapper.stop()
+            if session_data.future:
+                session_data.future.cancel()
+            wrapper.release()
             
-            # Remove session
-            del self.sessions[session_id]
-            logger.info(f"Removed session {session_id}")
+            logger.info("Removed session %s", session_id)
             
+    def stop_all(self):
+        """Request every running agent to stop"""
+        for session_data in tuple(self.sessions.values()):
+            if session_data.wrapper.is_running:
+                session_data.wrapper.stop()
+            
+    def reserve_run(self, session_data: SessionEntry, future, max_runs: int):
+        """
+        Record future as the session's agent run.
+        
+        The checks and the assignment happen under the lock, so concurrent
+        run requests cannot all pass the checks. Raises RunInProgressError
+        if the session already has a run, RunLimitError if max_runs runs
+        are active.
+        """
+        with self._lock:
+            current = session_data.future
+            if session_data.wrapper.is_running or (current and not current.done()):
+                raise RunInProgressError("Agent is already running")
+            if self.count_active_runs() >= max_runs:
+                raise RunLimitError(f"Server is at its limit of {max_runs} agent runs")
+            session_data.future = future
+            
+    def count_active_runs(self):
+        """Count agents that are running or waiting for a worker"""
+        active = 0
+        for session_data in tuple(self.sessions.values()):
+            future = session_data.future
+            if session_data.wrapper.is_running or (future and not future.done()):
+                active += 1
+        return active
+        
     def list_sessions(self):
         """List all active sessions"""
         sessions = []
-        for session_id, session_data in self.sessions.items():
+        for session_id, session_data in tuple(self.sessions.items()):
             sessions.append({
                 'session_id': session_id,
-                'connected_at': session_data['connected_at'],
-                'is_running': session_data['wrapper'].is_running,
-                'output_dir': session_data['output_dir']
+                'connected_at': session_data.connected_at,
+                'is_running': session_data.wrapper.is_running,
+                'output_dir': session_data.output_dir
             })
         return sessions
         
@@ -8,6 +8,8 @@ This module ensures the core is properly available and provides helpful error me
 import os
 import sys
 import logging
+import threading
+from types import SimpleNamespace
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +20,8 @@ class CoreLoader:
     def __init__(self):
         self.core_path = None
         self.core_loaded = False
-        self._core_modules = {}
+        self._core_modules = SimpleNamespace()
+        self._load_lock = threading.Lock()
         
     def setup_core_path(self, base_dir: str = None):
         """Setup the path to the SimpleAgent core"""
@@ -37,16 +40,27 @@ class CoreLoader:
             
     def _show_setup_error(self):
         """Show helpful error message when core is not found"""
-        print("❌ SimpleAgent core not found!")
-        print("Please run the setup script first:")
-        print("  Linux/Mac: ./setup_submodule.sh")
-        print("  Windows: setup_submodule.bat")
+        logger.error(
+            "❌ SimpleAgent core not found!\n"
+            "Please run the setup script first:\n"
+            "  Linux/Mac: ./setup_submodule.sh\n"
+            "  Windows: setup_submodule.bat"
+        )
         
     def load_core_modules(self):
         """Load and cache core modules"""
+        # Fast path without taking the lock once the core is loaded
         if self.core_loaded:
             return self._core_modules
-            
+        
+        with self._load_lock:
+            # Another thread may have finished loading while we waited
+            if self.core_loaded:
+                return self._core_modules
+            return self._import_core_modules()
+    
+    def _import_core_modules(self):
+        """Import the core modules; caller must hold the load lock"""
         try:
             # Import core modules
             import commands
@@ -63,59 +77,61 @@ class CoreLoader:
             from core.conversation.memory import MemoryManager
             
             # Cache the modules
-            self._core_modules = {
-                'commands': commands,
-                'REGISTERED_COMMANDS': REGISTERED_COMMANDS,
-                'COMMAND_SCHEMAS': COMMAND_SCHEMAS,
-                'SimpleAgent': SimpleAgent,
-                'OPENAI_API_KEY': OPENAI_API_KEY,
-                'MAX_STEPS': MAX_STEPS,
-                'API_PROVIDER': API_PROVIDER,
-                'API_BASE_URL': API_BASE_URL,
-                'GEMINI_API_KEY': GEMINI_API_KEY,
-                'create_client': create_client,
-                'DEFAULT_MODEL': DEFAULT_MODEL,
-                'AGENT_VERSION': AGENT_VERSION,
-                'RunManager': RunManager,
-                'ConversationManager': ConversationManager,
-                'ExecutionManager': ExecutionManager,
-                'MemoryManager': MemoryManager,
-            }
+            self._core_modules = SimpleNamespace(
+                commands=commands,
+                REGISTERED_COMMANDS=REGISTERED_COMMANDS,
+                COMMAND_SCHEMAS=COMMAND_SCHEMAS,
+                SimpleAgent=SimpleAgent,
+                OPENAI_API_KEY=OPENAI_API_KEY,
+                MAX_STEPS=MAX_STEPS,
+                API_PROVIDER=API_PROVIDER,
+                API_BASE_URL=API_BASE_URL,
+                GEMINI_API_KEY=GEMINI_API_KEY,
+                create_client=create_client,
+                DEFAULT_MODEL=DEFAULT_MODEL,
+                AGENT_VERSION=AGENT_VERSION,
+                RunManager=RunManager,
+                ConversationManager=ConversationManager,
+                ExecutionManager=ExecutionManager,
+                MemoryManager=MemoryManager
+            )
             
             self.core_loaded = True
             logger.info("SimpleAgent core modules loaded successfully")
             return self._core_modules
             
         except ImportError as e:
-            print(f"❌ Failed to import SimpleAgent core: {e}")
-            print("Please ensure the SimpleAgent core is properly set up.")
-            print("Run the setup script:")
-            print("  Linux/Mac: ./setup_submodule.sh")
-            print("  Windows: setup_submodule.bat")
+            logger.error(
+                "❌ Failed to import SimpleAgent core: %s\n"
+                "Please ensure the SimpleAgent core is properly set up.\n"
+                "Run the setup script:\n"
+                "  Linux/Mac: ./setup_submodule.sh\n"
+                "  Windows: setup_submodule.bat", e
+            )
             sys.exit(1)
             
     def validate_configuration(self):
         """Validate the core configuration"""
         core = self._core_modules
-        API_PROVIDER = core['API_PROVIDER']
+        API_PROVIDER = core.API_PROVIDER
         
         if API_PROVIDER == "lmstudio":
-            if not core['API_BASE_URL']:
+            if not core.API_BASE_URL:
                 logging.error("Error: API_BASE_URL environment variable not set for LM-Studio provider.")
                 logging.info("Please set API_BASE_URL to your LM-Studio endpoint (e.g., http://192.168.0.2:1234/v1)")
                 logging.info("You can set it in a .env file or in your environment variables.")
                 sys.exit(1)
-            logging.info(f"Using LM-Studio provider at: {core['API_BASE_URL']}")
+            logging.info(f"Using LM-Studio provider at: {core.API_BASE_URL}")
             
         elif API_PROVIDER == "openai":
-            if not core['OPENAI_API_KEY']:
+            if not core.OPENAI_API_KEY:
                 logging.error("Error: OPENAI_API_KEY environment variable not set for OpenAI provider.")
                 logging.info("Please set it in a .env file or in your environment variables.")
                 sys.exit(1)
             logging.info("Using OpenAI provider")
             
         elif API_PROVIDER == "gemini":
-            if not core['GEMINI_API_KEY']:
+            if not core.GEMINI_API_KEY:
                 logging.error("Error: GEMINI_API_KEY environment variable not set for Gemini provider.")
                 logging.info("Please set it in a .env file or in your environment variables.")
                 sys.exit(1)
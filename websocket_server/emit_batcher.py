@@ -0,0 +1,92 @@
+"""
+Emit Batcher
+
+Coalesces WebSocket events sent to the same room into a single Socket.IO
+frame, so bursts of small agent events cost one socket write instead of many.
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class EmitBatcher:
+    """
+    Drop-in replacement for ``socketio.emit`` that buffers events per room.
+
+    Events queued for a room are flushed after ``batch_ms`` milliseconds or
+    as soon as ``batch_max`` events are pending. A flush of a single event is
+    sent unchanged; a flush of several is sent as one ``event_batch`` event
+    whose ``events`` list holds ``{'event': name, 'data': payload}`` entries
+    in emission order.
+    """
+
+    def __init__(self, socketio, batch_ms: int = 50, batch_max: int = 140):
+        self.socketio = socketio
+        self.batch_interval = batch_ms / 1000.0
+        self.batch_max = batch_max
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def emit(self, event: str, data, room: str = None, **kwargs):
+        """Queue an event for a room, flushing immediately when the batch is full"""
+        # Broadcasts and emits with extra options are not batched
+        if room is None or kwargs:
+            self.socketio.emit(event, data, room=room, **kwargs)
+            return
+
+        with self._lock:
+            pending = self._pending.get(room)
+            schedule_flush = pending is None
+            if schedule_flush:
+                pending = self._pending[room] = []
+            pending.append({'event': event, 'data': data})
+            batch_full = len(pending) >= self.batch_max
+
+        if batch_full:
+            self.flush(room)
+        elif schedule_flush:
+            self.socketio.start_background_task(self._flush_later, room)
+
+    def start_background_task(self, target, *args, **kwargs):
+        """Start a task on the wrapped server, so the batcher can stand in for it"""
+        return self.socketio.start_background_task(target, *args, **kwargs)
+
+    def sleep(self, seconds: float = 0):
+        """Sleep in the wrapped server's async mode"""
+        return self.socketio.sleep(seconds)
+
+    def _flush_later(self, room: str):
+        """Flush a room's batch once the batch interval has elapsed"""
+        self.socketio.sleep(self.batch_interval)
+        self.flush(room)
+
+    def discard(self, room: str):
+        """Drop pending events for a room whose client has gone away"""
+        with self._lock:
+            self._pending.pop(room, None)
+
+    def flush_all(self):
+        """Send all pending events for every room"""
+        with self._lock:
+            rooms = list(self._pending)
+
+        for room in rooms:
+            self.flush(room)
+
+    def flush(self, room: str):
+        """Send all pending events for a room"""
+        with self._lock:
+            events = self._pending.pop(room, None)
+
+        if not events:
+            return
+
+        try:
+            if len(events) == 1:
+                self.socketio.emit(events[0]['event'], events[0]['data'], room=room)
+            else:
+                self.socketio.emit('event_batch', {'events': events}, room=room)
+        except Exception as e:
+            logger.warning("Failed to flush %d batched event(s) to room %s: %s", len(events), room, e)
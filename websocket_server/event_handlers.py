@@ -4,43 +4,89 @@ WebSocket Event Handlers
 Handles all WebSocket events for the SimpleAgent WebSocket server.
 """
 
+import os
 import logging
-import threading
+from functools import wraps
+from concurrent.futures import Future, ThreadPoolExecutor
 from flask import request
 from flask_socketio import emit, disconnect
-from datetime import datetime
 
 from .core_loader import core_loader
-from .agent_wrapper import SessionManager
+from .agent_wrapper import SessionManager, SessionLimitError, RunInProgressError, RunLimitError
+from .timestamps import now_iso
 
 logger = logging.getLogger(__name__)
 
 # Global session manager
 session_manager = SessionManager()
 
+# Upper bound on agent runs executing or queued at once; further run
+# requests are rejected as busy
+MAX_AGENT_RUNS = int(os.environ.get('MAX_AGENT_RUNS', 50))
+
+# Upper bound on entries in a files_list event; only the most recently
+# created files are sent
+MAX_FILES_LISTED = int(os.environ.get('MAX_FILES_LISTED', 500))
+
+# Worker pool for agent runs in threading mode; reuses threads. Under eventlet
+# and gevent its threads would be green threads anyway, which are cheap to
+# start, so those modes run each agent as a Socket.IO background task instead.
+agent_pool = ThreadPoolExecutor(max_workers=MAX_AGENT_RUNS, thread_name_prefix='agent')
+
+# Fixed error payloads, shared by all handlers; treat as read-only
+ERR_NO_SESSION = {'message': 'Session not found'}
+ERR_ALREADY_RUNNING = {'message': 'Agent is already running'}
+ERR_INSTRUCTION_REQUIRED = {'message': 'Instruction is required'}
+ERR_SERVER_BUSY = {'message': 'Server busy: too many agents running, try again later'}
+ERR_NOT_RUNNING = {'message': 'Agent is not running'}
+ERR_INPUT_REQUIRED = {'message': 'Input is required'}
+
 
 def safe_emit(event, data, **kwargs):
     """Safely emit a WebSocket event with error handling"""
     try:
         emit(event, data, **kwargs)
     except Exception as e:
-        logger.warning(f"Failed to emit event '{event}': {e}")
+        logger.warning("Failed to emit event '%s': %s", event, e)
 
 
-def register_handlers(socketio):
-    """Register all WebSocket event handlers"""
+def register_handlers(socketio, emitter=None):
+    """
+    Register all WebSocket event handlers.
+    
+    Agent runs send their events through ``emitter`` (e.g. an EmitBatcher),
+    falling back to ``socketio`` itself.
+    """
+    if emitter is None:
+        emitter = socketio
+    
+    # Version info does not change at runtime; look it up once for all handlers
+    core = core_loader.load_core_modules()
+    AGENT_VERSION = core.AGENT_VERSION
+    API_PROVIDER = core.API_PROVIDER
+    
+    # The sessions dict is only mutated, never rebound, so its bound get()
+    # can be held for the lifetime of the handlers
+    get_session = session_manager.sessions.get
+    
+    def requires_session(handler):
+        """Look up the caller's session and pass it to the handler, or reply with an error"""
+        @wraps(handler)
+        def wrapper(*args):
+            session_id = request.sid
+            session_data = get_session(session_id)
+            if session_data is None:
+                safe_emit('error', ERR_NO_SESSION)
+                return
+            return handler(session_id, session_data, *args)
+        return wrapper
     
     @socketio.on('connect')
     def handle_connect():
         """Handle client connection"""
+        session_id = request.sid
         try:
-            session_id = request.sid
-            logger.info(f"Client connected: {session_id}")
-            
-            # Load core modules for version info
-            core = core_loader.load_core_modules()
-            AGENT_VERSION = core['AGENT_VERSION']
-            API_PROVIDER = core['API_PROVIDER']
+            logger.info("Client connected: %s", session_id)
             
             # Create session
             session_data = session_manager.create_session(session_id)
@@ -50,9 +96,13 @@ def register_handlers(socketio):
                 'session_id': session_id,
                 'agent_version': AGENT_VERSION,
                 'api_provider': API_PROVIDER,
-                'output_dir': session_data['output_dir'],
-                'timestamp': datetime.now().isoformat()
+                'output_dir': session_data.output_dir,
+                'timestamp': now_iso()
             })
+        except SessionLimitError as e:
+            logger.warning("Rejected connection %s: %s", session_id, e)
+            safe_emit('error', {'message': str(e)})
+            disconnect()
         except Exception as e:
             logger.exception("Exception in handle_connect")
             safe_emit('error', {'message': str(e)})
@@ -66,29 +116,25 @@ def register_handlers(socketio):
         """Handle client disconnection"""
         try:
             session_id = request.sid
-            logger.info(f"Client disconnected: {session_id}")
+            logger.info("Client disconnected: %s", session_id)
             
             # Clean up session
             session_manager.remove_session(session_id)
         except Exception as e:
-            logger.warning(f"Error during disconnect cleanup: {e}")
+            logger.warning("Error during disconnect cleanup: %s", e)
 
     @socketio.on('run_agent')
-    def handle_run_agent(data):
+    @requires_session
+    def handle_run_agent(session_id, session_data, data):
         """Handle agent run request"""
         try:
-            session_id = request.sid
-            
-            session_data = session_manager.get_session(session_id)
-            if not session_data:
-                safe_emit('error', {'message': 'Session not found'})
-                return
-            
-            wrapper = session_data['wrapper']
+            wrapper = session_data.wrapper
             
-            # Check if agent is already running
-            if wrapper.is_running:
-                safe_emit('error', {'message': 'Agent is already running'})
+            # Check if agent is already running or queued for a worker;
+            # reserve_run() below repeats the check atomically
+            future = session_data.future
+            if wrapper.is_running or (future and not future.done()):
+                safe_emit('error', ERR_ALREADY_RUNNING)
                 return
             
             # Extract parameters
@@ -97,49 +143,85 @@ def register_handlers(socketio):
             auto_continue = data.get('auto_continue', 0)
             
             if not instruction:
-                safe_emit('error', {'message': 'Instruction is required'})
+                safe_emit('error', ERR_INSTRUCTION_REQUIRED)
                 return
             
-            # Run agent in a separate thread
+            # Run agent on the worker pool or as a green background task
             def run_agent_thread():
                 try:
-                    wrapper.run_async(instruction, max_steps, auto_continue, socketio)
+                    wrapper.run_async(instruction, max_steps, auto_continue, emitter)
                 except Exception as e:
                     logger.exception("Error in agent thread")
-                    safe_emit('agent_error', {
-                        'error': str(e),
-                        'timestamp': datetime.now().isoformat()
-                    })
+                    # No request context here, so address the session's room
+                    try:
+                        emitter.emit('agent_error', {
+                            'error': str(e),
+                            'timestamp': now_iso()
+                        }, room=session_id)
+                    except Exception as emit_error:
+                        logger.warning("Failed to emit event 'agent_error': %s", emit_error)
+            
+            # Track the run the same way in every mode, so the session counts
+            # as busy and the run can be cancelled before it starts
+            future = Future()
+            
+            def run_agent_task():
+                if not future.set_running_or_notify_cancel():
+                    return
+                try:
+                    run_agent_thread()
+                finally:
+                    future.set_result(None)
+            
+            # Checks for a run in progress and the run limit, and records
+            # the run, in one step; concurrent requests cannot all pass
+            try:
+                session_manager.reserve_run(session_data, future, MAX_AGENT_RUNS)
+            except RunInProgressError:
+                safe_emit('error', ERR_ALREADY_RUNNING)
+                return
+            except RunLimitError:
+                safe_emit('error', ERR_SERVER_BUSY)
+                return
             
-            thread = threading.Thread(target=run_agent_thread)
-            thread.daemon = True
-            thread.start()
+            try:
+                if socketio.async_mode == 'threading':
+                    agent_pool.submit(run_agent_task)
+                else:
+                    socketio.start_background_task(run_agent_task)
+            except Exception:
+                # Do not leave the session marked busy by a run that never starts
+                future.cancel()
+                raise
         except Exception as e:
             logger.exception("Exception in handle_run_agent")
             safe_emit('error', {'message': str(e)})
 
     @socketio.on('stop_agent')
-    def handle_stop_agent():
+    @requires_session
+    def handle_stop_agent(session_id, session_data):
         """Handle agent stop request"""
         try:
-            session_id = request.sid
-            
-            session_data = session_manager.get_session(session_id)
-            if not session_data:
-                safe_emit('error', {'message': 'Session not found'})
+            wrapper = session_data.wrapper
+            
+            # A run still queued for a pool worker can be cancelled outright
+            future = session_data.future
+            if not wrapper.is_running and future is not None and future.cancel():
+                safe_emit('agent_stop_requested', {
+                    'success': True,
+                    'timestamp': now_iso()
+                })
                 return
             
-            wrapper = session_data['wrapper']
-            
             if not wrapper.is_running:
-                safe_emit('error', {'message': 'Agent is not running'})
+                safe_emit('error', ERR_NOT_RUNNING)
                 return
             
             # Stop the agent
             success = wrapper.stop()
             safe_emit('agent_stop_requested', {
                 'success': success,
-                'timestamp': datetime.now().isoformat()
+                'timestamp': now_iso()
             })
             # Note: 'agent_stopped' will be emitted by the agent when it actually stops (see run_manager.py)
         except Exception as e:
@@ -147,119 +229,107 @@ def register_handlers(socketio):
             safe_emit('error', {'message': str(e)})
 
     @socketio.on('user_input')
-    def handle_user_input(data):
+    @requires_session
+    def handle_user_input(session_id, session_data, data):
         """Handle user input for running agent"""
         try:
-            session_id = request.sid
-            
-            session_data = session_manager.get_session(session_id)
-            if not session_data:
-                safe_emit('error', {'message': 'Session not found'})
-                return
-            
-            wrapper = session_data['wrapper']
+            wrapper = session_data.wrapper
             
             if not wrapper.is_running:
-                safe_emit('error', {'message': 'Agent is not running'})
+                safe_emit('error', ERR_NOT_RUNNING)
                 return
             
             user_input = data.get('input', '')
             if not user_input:
-                safe_emit('error', {'message': 'Input is required'})
+                safe_emit('error', ERR_INPUT_REQUIRED)
                 return
             
             # Provide input to the agent
             wrapper.provide_user_input(user_input)
             safe_emit('user_input_sent', {
                 'input': user_input,
-                'timestamp': datetime.now().isoformat()
+                'timestamp': now_iso()
             })
         except Exception as e:
             logger.exception("Exception in handle_user_input")
             safe_emit('error', {'message': str(e)})
 
     @socketio.on('get_status')
-    def handle_get_status():
+    @requires_session
+    def handle_get_status(session_id, session_data):
         """Handle status request"""
         try:
-            session_id = request.sid
-            
-            session_data = session_manager.get_session(session_id)
-            if not session_data:
-                safe_emit('error', {'message': 'Session not found'})
-                return
-            
-            wrapper = session_data['wrapper']
-            
-            # Load core modules for version info
-            core = core_loader.load_core_modules()
-            AGENT_VERSION = core['AGENT_VERSION']
-            API_PROVIDER = core['API_PROVIDER']
+            wrapper = session_data.wrapper
             
             safe_emit('status', {
                 'session_id': session_id,
                 'is_running': wrapper.is_running,
-                'connected_at': session_data['connected_at'],
+                'connected_at': session_data.connected_at,
                 'agent_version': AGENT_VERSION,
                 'api_provider': API_PROVIDER,
-                'output_dir': session_data['output_dir'],
-                'timestamp': datetime.now().isoformat()
+                'output_dir': session_data.output_dir,
+                'timestamp': now_iso()
             })
         except Exception as e:
             logger.exception("Exception in handle_get_status")
             safe_emit('error', {'message': str(e)})
 
     @socketio.on('get_files')
-    def handle_get_files(data=None):
+    @requires_session
+    def handle_get_files(session_id, session_data, data=None):
         """Handle request to get list of created files"""
         try:
-            session_id = request.sid
-            
-            session_data = session_manager.get_session(session_id)
-            if not session_data:
-                safe_emit('error', {'message': 'Session not found'})
-                return
+            wrapper = session_data.wrapper
             
-            wrapper = session_data['wrapper']
+            # A client that passes the previous 'next' value as 'since'
+            # receives only newer files
+            since = (data or {}).get('since', 0)
+            if not isinstance(since, int) or since < 0:
+                since = 0
             
             # Get created files if run manager exists
             files = []
-            if hasattr(wrapper, 'run_manager') and wrapper.run_manager:
-                files = wrapper.run_manager.get_created_files()
+            total = 0
+            run_manager = wrapper.run_manager
+            if run_manager is not None:
+                files, total = run_manager.get_created_files_since(since)
+            
+            # The tail is the newest
+            available = len(files)
+            if available > MAX_FILES_LISTED:
+                files = files[-MAX_FILES_LISTED:]
             
             safe_emit('files_list', {
                 'session_id': session_id,
                 'files': files,
                 'count': len(files),
-                'timestamp': datetime.now().isoformat()
+                'total': total,
+                'next': total,
+                'truncated': available > len(files),
+                'timestamp': now_iso()
             })
         except Exception as e:
             logger.exception("Exception in handle_get_files")
             safe_emit('error', {'message': str(e)})
 
     @socketio.on('refresh_files')
-    def handle_refresh_files():
+    @requires_session
+    def handle_refresh_files(session_id, session_data):
         """Handle request to refresh/scan for new files"""
         try:
-            session_id = request.sid
-            
-            session_data = session_manager.get_session(session_id)
-            if not session_data:
-                safe_emit('error', {'message': 'Session not found'})
-                return
-            
-            wrapper = session_data['wrapper']
+            wrapper = session_data.wrapper
             
             # Scan for new files if run manager exists
             new_files = []
-            if hasattr(wrapper, 'run_manager') and wrapper.run_manager:
-                new_files = wrapper.run_manager._scan_for_new_files()
+            run_manager = wrapper.run_manager
+            if run_manager is not None:
+                new_files = run_manager._scan_for_new_files()
             
             safe_emit('files_refreshed', {
                 'session_id': session_id,
                 'new_files': new_files,
                 'count': len(new_files),
-                'timestamp': datetime.now().isoformat()
+                'timestamp': now_iso()
             })
         except Exception as e:
             logger.exception("Exception in handle_refresh_files")
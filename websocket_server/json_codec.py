@@ -0,0 +1,82 @@
+"""
+JSON Codec
+
+JSON encoding for Socket.IO packets and Flask responses. Uses orjson when it
+is installed and falls back to the standard library otherwise.
+"""
+
+import json
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj, **kwargs):
+    """
+    Serialize obj to a compact JSON string.
+    
+    The separators option is ignored, as the output is always compact, which
+    is what Socket.IO asks for; other options such as default or cls take
+    the standard library path. Unlike the standard library, orjson writes
+    NaN and +/-Infinity as null, which JSON.parse accepts, instead of the
+    non-standard NaN and Infinity tokens.
+    """
+    if orjson is None:
+        return json.dumps(obj, **kwargs)
+    options = dict(kwargs)
+    options.pop('separators', None)
+    if options:
+        return json.dumps(obj, **kwargs)
+    # Non-str dict keys are stringified as the standard library does
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    except orjson.JSONEncodeError:
+        # Payloads orjson rejects (e.g. integers beyond 64 bits) take the slow path
+        return json.dumps(obj, separators=(',', ':'))
+
+
+def loads(s, **kwargs):
+    """Deserialize a JSON string or bytes"""
+    if orjson is None:
+        return json.loads(s, **kwargs)
+    return orjson.loads(s)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes responses with orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        """
+        Serialize obj to a JSON string like Flask's default provider.
+        
+        datetime values and dataclasses are passed to Flask's default(), so
+        they keep Flask's HTTP-date and dict forms, and debug-mode
+        indentation is kept. Non-ASCII text is written as UTF-8 rather than
+        \\u escapes. Options orjson has no equivalent for take the standard
+        library path.
+        """
+        options = dict(kwargs)
+        indent = options.pop('indent', None)
+        options.pop('separators', None)
+        if orjson is None or options or indent not in (None, 2):
+            return super().dumps(obj, **kwargs)
+        
+        option = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                  | orjson.OPT_PASSTHROUGH_DATACLASS)
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+        except orjson.JSONEncodeError:
+            return super().dumps(obj, **kwargs)
+    
+    def loads(self, s, **kwargs):
+        """Deserialize a JSON string or bytes"""
+        if orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
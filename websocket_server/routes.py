@@ -5,103 +5,168 @@ HTTP endpoints for the SimpleAgent WebSocket server.
 """
 
 import os
-from flask import Blueprint, send_file, abort, jsonify, Response
-from datetime import datetime
+from urllib.parse import quote
+from flask import Blueprint, send_file, abort, Response, current_app
 
+from . import json_codec
 from .core_loader import core_loader
-from .event_handlers import get_session_manager
+from .event_handlers import session_manager
+from .timestamps import now_iso
+
+# File contents are streamed to the client in chunks of this many characters
+FILE_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Largest file the content view will serve; bigger files must be downloaded
+MAX_VIEW_BYTES = int(os.environ.get('MAX_VIEW_BYTES', 10 * 1024 * 1024))
+
+# Content is always served as plain text so agent-written HTML or scripts
+# are never rendered by the browser on this origin
+FILE_CONTENT_TYPE = 'text/plain; charset=utf-8'
 
 # Create blueprint for routes
 api_bp = Blueprint('api', __name__)
 
+# Version fields shared by /health and /version; filled in on first request
+_version_info = None
+
+
+def _get_version_info():
+    """Return the agent version fields, which do not change at runtime"""
+    global _version_info
+    
+    if _version_info is None:
+        core = core_loader.load_core_modules()
+        
+        # Import websocket server version
+        try:
+            from . import __version__ as websocket_version
+        except ImportError:
+            websocket_version = "1.0.0"
+        
+        _version_info = {
+            'websocket_server_version': websocket_version,
+            'agent_core_version': core.AGENT_VERSION,
+            'api_provider': core.API_PROVIDER
+        }
+    return _version_info
+
+
+def _chunk_reader(f):
+    """
+    Return a function that reads the next chunk of f.
+    
+    Under eventlet or gevent the read runs on a native thread pool so a
+    slow disk stalls only this request, not every connection on the hub.
+    """
+    async_mode = current_app.extensions['socketio'].async_mode
+    if async_mode == 'eventlet':
+        from eventlet import tpool
+        return lambda: tpool.execute(f.read, FILE_STREAM_CHUNK_SIZE)
+    if async_mode == 'gevent':
+        import gevent
+        return lambda: gevent.get_hub().threadpool.apply(f.read, (FILE_STREAM_CHUNK_SIZE,))
+    return lambda: f.read(FILE_STREAM_CHUNK_SIZE)
+
+
+def _resolve_session_file(session_data, filename):
+    """Return the path of a file in the session's output directory, or abort"""
+    # Resolve symlinks so a link created by the agent cannot point outside
+    output_dir = session_data.real_output_dir
+    file_path = os.path.realpath(os.path.join(output_dir, filename))
+    
+    # Security check: ensure the file is within the session's output directory
+    try:
+        inside = os.path.commonpath((output_dir, file_path)) == output_dir
+    except ValueError:
+        inside = False  # e.g. different drives on Windows
+    if not inside:
+        abort(403, description="Access denied")
+    
+    # Check if file exists
+    if not os.path.isfile(file_path):
+        abort(404, description="File not found")
+    
+    # Check if this file was created by the agent (optional security check)
+    run_manager = session_data.wrapper.run_manager
+    if run_manager is not None and not run_manager.is_created_file(filename):
+        abort(403, description="File not created by agent")
+    
+    return file_path
+
 
 @api_bp.route('/health')
 def health_check():
     """Health check endpoint"""
-    # Load core modules for version info
-    core = core_loader.load_core_modules()
-    AGENT_VERSION = core['AGENT_VERSION']
-    API_PROVIDER = core['API_PROVIDER']
-    
-    session_manager = get_session_manager()
+    version_info = _get_version_info()
     
     return {
         'status': 'healthy',
-        'agent_version': AGENT_VERSION,
-        'api_provider': API_PROVIDER,
+        'agent_version': version_info['agent_core_version'],
+        'api_provider': version_info['api_provider'],
         'active_sessions': session_manager.get_session_count(),
-        'timestamp': datetime.now().isoformat()
+        'timestamp': now_iso()
     }
 
 
 @api_bp.route('/sessions')
 def list_sessions():
     """List active sessions"""
-    session_manager = get_session_manager()
     sessions = session_manager.list_sessions()
     
     return {
         'sessions': sessions,
         'count': len(sessions),
-        'timestamp': datetime.now().isoformat()
+        'timestamp': now_iso()
     }
 
 
 @api_bp.route('/sessions/<session_id>/files')
 def list_session_files(session_id):
     """List files created by a specific session"""
-    session_manager = get_session_manager()
     session_data = session_manager.get_session(session_id)
     
     if not session_data:
         abort(404, description="Session not found")
     
-    wrapper = session_data['wrapper']
-    if hasattr(wrapper, 'run_manager') and wrapper.run_manager:
-        files = wrapper.run_manager.get_created_files()
-        return {
-            'session_id': session_id,
-            'files': files,
-            'count': len(files),
-            'timestamp': datetime.now().isoformat()
-        }
+    wrapper = session_data.wrapper
+    run_manager = wrapper.run_manager
+    if run_manager is not None:
+        # Splice the cached file list into the response instead of
+        # encoding it again on every poll
+        files_json, count = run_manager.get_created_files_json()
+        body = '{"count":%d,"files":%s,"session_id":%s,"timestamp":%s}' % (
+            count, files_json, json_codec.dumps(session_id), json_codec.dumps(now_iso())
+        )
+        return Response(body, mimetype='application/json')
     
     return {
         'session_id': session_id,
         'files': [],
         'count': 0,
-        'timestamp': datetime.now().isoformat()
+        'timestamp': now_iso()
     }
 
 
 @api_bp.route('/sessions/<session_id>/files/<path:filename>')
 def download_session_file(session_id, filename):
     """Download a file created by a specific session"""
-    session_manager = get_session_manager()
     session_data = session_manager.get_session(session_id)
     
     if not session_data:
         abort(404, description="Session not found")
     
-    # Get the session's output directory
-    output_dir = session_data['output_dir']
-    file_path = os.path.join(output_dir, filename)
+    file_path = _resolve_session_file(session_data, filename)
     
-    # Security check: ensure the file is within the session's output directory
-    if not os.path.abspath(file_path).startswith(os.path.abspath(output_dir)):
-        abort(403, description="Access denied")
-    
-    # Check if file exists
-    if not os.path.exists(file_path):
-        abort(404, description="File not found")
-    
-    # Check if this file was created by the agent (optional security check)
-    wrapper = session_data['wrapper']
-    if hasattr(wrapper, 'run_manager') and wrapper.run_manager:
-        created_files = wrapper.run_manager.get_created_files()
-        file_allowed = any(f['relative_path'] == filename for f in created_files)
-        if not file_allowed:
-            abort(403, description="File not created by agent")
+    # Behind nginx, hand the transfer to the proxy instead of streaming
+    # the bytes through this process
+    accel_prefix = current_app.config.get('X_ACCEL_REDIRECT_PREFIX')
+    if accel_prefix:
+        relative_path = os.path.relpath(file_path, os.path.dirname(session_data.real_output_dir))
+        response = Response(headers={
+            'X-Accel-Redirect': f"{accel_prefix.rstrip('/')}/{quote(relative_path.replace(os.sep, '/'))}"
+        })
+        response.headers.set('Content-Disposition', 'attachment', filename=os.path.basename(filename))
+        return response
     
     try:
         return send_file(
@@ -116,69 +181,50 @@ def download_session_file(session_id, filename):
 @api_bp.route('/sessions/<session_id>/files/<path:filename>/content')
 def view_session_file_content(session_id, filename):
     """View the content of a file created by a specific session"""
-    session_manager = get_session_manager()
     session_data = session_manager.get_session(session_id)
     
     if not session_data:
         abort(404, description="Session not found")
     
-    # Get the session's output directory
-    output_dir = session_data['output_dir']
-    file_path = os.path.join(output_dir, filename)
+    file_path = _resolve_session_file(session_data, filename)
     
-    # Security check: ensure the file is within the session's output directory
-    if not os.path.abspath(file_path).startswith(os.path.abspath(output_dir)):
-        abort(403, description="Access denied")
-    
-    # Check if file exists
-    if not os.path.exists(file_path):
-        abort(404, description="File not found")
-    
-    # Check if this file was created by the agent (optional security check)
-    wrapper = session_data['wrapper']
-    if hasattr(wrapper, 'run_manager') and wrapper.run_manager:
-        created_files = wrapper.run_manager.get_created_files()
-        file_allowed = any(f['relative_path'] == filename for f in created_files)
-        if not file_allowed:
-            abort(403, description="File not created by agent")
+    if os.path.getsize(file_path) > MAX_VIEW_BYTES:
+        abort(413, description=f"File is larger than {MAX_VIEW_BYTES} bytes; download it instead")
     
     try:
-        # Read file content
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Determine content type based on file extension
-        file_ext = os.path.splitext(filename)[1].lower()
-        if file_ext in ['.txt', '.md', '.py', '.js', '.html', '.css', '.json', '.yml', '.yaml']:
-            content_type = 'text/plain; charset=utf-8'
-        else:
-            content_type = 'text/plain; charset=utf-8'
-        
-        return Response(content, mimetype=content_type)
-        
+        # Decode the first chunk up front so non-text files are still
+        # rejected before the response starts
+        f = open(file_path, 'r', encoding='utf-8')
+        try:
+            read_chunk = _chunk_reader(f)
+            first_chunk = read_chunk()
+        except BaseException:
+            f.close()
+            raise
     except UnicodeDecodeError:
         abort(400, description="File is not a text file or has unsupported encoding")
     except Exception as e:
         abort(500, description=f"Error reading file: {str(e)}")
+    
+    # NUL bytes decode as UTF-8 but mark binary content
+    if '\x00' in first_chunk:
+        f.close()
+        abort(415, description="File is not a text file")
+    
+    def generate():
+        with f:
+            chunk = first_chunk
+            while chunk:
+                yield chunk
+                chunk = read_chunk()
+    
+    return Response(generate(), mimetype=FILE_CONTENT_TYPE)
 
 
 @api_bp.route('/version')
 def get_version():
     """Get version information"""
-    # Load core modules for version info
-    core = core_loader.load_core_modules()
-    AGENT_VERSION = core['AGENT_VERSION']
-    API_PROVIDER = core['API_PROVIDER']
-    
-    # Import websocket server version
-    try:
-        from . import __version__ as websocket_version
-    except ImportError:
-        websocket_version = "1.0.0"
-    
     return {
-        'websocket_server_version': websocket_version,
-        'agent_core_version': AGENT_VERSION,
-        'api_provider': API_PROVIDER,
-        'timestamp': datetime.now().isoformat()
+        **_get_version_info(),
+        'timestamp': now_iso()
     } 
\ No newline at end of file
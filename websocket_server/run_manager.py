@@ -5,17 +5,201 @@ Extends the core RunManager to provide WebSocket-based real-time communication
 and event emission capabilities.
 """
 
-import json
+import os
+import re
 import time
-import queue
+import builtins
+import base64
 import logging
+import itertools
+import threading
 from typing import Dict, Any
-from datetime import datetime
 
+from . import json_codec
 from .core_loader import core_loader
+from .emit_batcher import EmitBatcher
+from .timestamps import now_iso, iso_from_ns
 
 logger = logging.getLogger(__name__)
 
+# Directories modified more recently than this are listed on every scan
+DIR_CACHE_MIN_AGE_NS = 2_000_000_000
+
+# File records kept per run; older records are dropped from created_files
+# but stay in the membership indexes, so they are neither re-reported nor
+# refused for download
+MAX_TRACKED_FILES = 1000
+
+# Background scans wait this long so a burst of tool calls shares one scan
+SCAN_DEBOUNCE_SECONDS = 0.15
+
+# Tool results longer than this are streamed in tool_call_chunk events
+TOOL_RESULT_CHUNK_SIZE = 64 * 1024
+
+# Markers in the core's print() output and the WebSocketRunManager methods
+# that turn them into WebSocket events
+PRINT_EVENT_HANDLERS = {
+    "--- Step": '_on_step_marker',
+    "✅ Task completed": '_on_task_completed_marker',
+    "🔄 Changed working directory to:": '_on_directory_marker',
+    "🔄 Auto-continuing": '_on_auto_continue_marker',
+    "⚠️": '_on_warning_marker',
+}
+
+# Finds every marker in a line in a single scan
+PRINT_EVENT_MARKERS = re.compile('|'.join(re.escape(marker) for marker in PRINT_EVENT_HANDLERS))
+
+# When a line holds several markers, the one listed first in
+# PRINT_EVENT_HANDLERS wins, wherever it appears in the line
+PRINT_EVENT_PRIORITY = {marker: rank for rank, marker in enumerate(PRINT_EVENT_HANDLERS)}
+
+
+# Run manager driving the agent on the current thread (greenlet-local once
+# eventlet has patched threading)
+_current_run = threading.local()
+# Run managers with a run in progress, in any thread
+_active_runs = set()
+_builtin_hooks_lock = threading.Lock()
+_builtin_hooks_installed = False
+
+
+def _run_for_current_thread():
+    """
+    Find the run manager that print() and input() calls on this thread belong to.
+    
+    Threads a run starts itself (e.g. a tool's worker pool) are not
+    registered, so their calls go to the only active run if there is
+    exactly one, and to no run otherwise.
+    """
+    run = getattr(_current_run, 'manager', None)
+    if run is None:
+        active = tuple(_active_runs)
+        if len(active) == 1:
+            run = active[0]
+    return run
+
+
+def _install_builtin_hooks():
+    """
+    Replace print() and input() once for the whole process.
+    
+    The replacements dispatch to the run manager registered for the calling
+    thread, so concurrent runs never see each other's output or swap the
+    builtins out from under one another. Calls from other threads go to
+    the only active run; with no run active they fall through to the
+    originals, and input() raises EOFError rather than block on the
+    server's stdin while several runs are active.
+    """
+    global _builtin_hooks_installed
+    
+    with _builtin_hooks_lock:
+        if _builtin_hooks_installed:
+            return
+        
+        original_print = builtins.print
+        original_input = builtins.input
+        
+        def websocket_print(*args, **kwargs):
+            """Print as usual, then let the current run emit events for the text"""
+            original_print(*args, **kwargs)
+            run = _run_for_current_thread()
+            if run is not None:
+                run.handle_print(args)
+        
+        def websocket_input(prompt=""):
+            """Ask the current run's WebSocket client instead of stdin"""
+            run = _run_for_current_thread()
+            if run is not None:
+                return run.get_user_input(prompt)
+            if _active_runs:
+                logger.warning("input() called on a thread that belongs to no agent run while "
+                               "%d runs are active; not reading stdin", len(_active_runs))
+                raise EOFError("input() is not available outside an agent run")
+            return original_input(prompt)
+        
+        builtins.print = websocket_print
+        builtins.input = websocket_input
+        _builtin_hooks_installed = True
+
+
+class InputCancelled(EOFError):
+    """Raised by input() in a run that was stopped while waiting for an answer"""
+
+
+def _message_field(message, name):
+    """Read a field from a chat message given as a dict or an SDK object"""
+    if isinstance(message, dict):
+        return message.get(name)
+    return getattr(message, name, None)
+
+
+def _without_tool_calls(message):
+    """Return an assistant message's text without its tool calls, or None if it has no text"""
+    content = _message_field(message, 'content')
+    if not content:
+        return None
+    if isinstance(message, dict):
+        return {key: value for key, value in message.items() if key != 'tool_calls'}
+    # SDK message objects are replaced by the dict form the LLM API also accepts
+    return {'role': 'assistant', 'content': content}
+
+
+def _remove_orphaned_tool_messages(history: list) -> int:
+    """
+    Drop tool messages the LLM API would reject, in place.
+    
+    Removes tool results whose tool call is not in the history, and the
+    tool calls of assistant messages whose calls did not all get a result
+    (e.g. a stopped run) together with their partial results. The
+    assistant's text is kept; a message with no text is dropped. Returns
+    the number of messages removed or rewritten.
+    """
+    call_ids = set()
+    result_ids = set()
+    for message in history:
+        role = _message_field(message, 'role')
+        if role == 'assistant':
+            for tool_call in _message_field(message, 'tool_calls') or ():
+                call_ids.add(_message_field(tool_call, 'id'))
+        elif role == 'tool':
+            result_ids.add(_message_field(message, 'tool_call_id'))
+    
+    if call_ids == result_ids:
+        return 0
+    
+    # Calls with a missing result are dropped with all calls of their turn
+    dropped_calls = set()
+    for message in history:
+        if _message_field(message, 'role') == 'assistant':
+            ids = {_message_field(tool_call, 'id')
+                   for tool_call in _message_field(message, 'tool_calls') or ()}
+            if not ids <= result_ids:
+                dropped_calls |= ids
+    valid_calls = call_ids - dropped_calls
+    
+    kept = []
+    changed = 0
+    for message in history:
+        role = _message_field(message, 'role')
+        if role == 'tool':
+            if _message_field(message, 'tool_call_id') not in valid_calls:
+                changed += 1
+                continue
+        elif role == 'assistant' and dropped_calls:
+            tool_calls = _message_field(message, 'tool_calls')
+            if tool_calls and _message_field(tool_calls[0], 'id') in dropped_calls:
+                changed += 1
+                message = _without_tool_calls(message)
+                if message is None:
+                    continue
+        kept.append(message)
+    
+    if changed:
+        logger.warning("Removed %d orphaned tool message(s) or call(s) from the conversation", changed)
+        # Slice assignment keeps the core's list object
+        history[:] = kept
+    return changed
+
 
 class WebSocketRunManager:
     """
@@ -26,7 +210,7 @@ class WebSocketRunManager:
     def __init__(self, model: str, output_dir: str, session_id: str, socketio_instance):
         # Load core modules
         core = core_loader.load_core_modules()
-        RunManager = core['RunManager']
+        RunManager = core.RunManager
         
         # Initialize the base run manager
         self.run_manager = RunManager(model, output_dir)
@@ -34,13 +218,32 @@ class WebSocketRunManager:
         # WebSocket specific attributes
         self.session_id = session_id
         self.socketio = socketio_instance
-        self.user_input_queue = queue.Queue()
+        # Single-slot hand-off between the handler (producer) and agent (consumer)
+        self._pending_input = None
+        self._input_ready = threading.Event()
         self.waiting_for_input = False
         self.stop_requested = False
+        # Numbers tool_call events so clients can match their chunks
+        self._tool_call_ids = itertools.count(1)
         
         # File tracking
         self.created_files = []
         self.initial_files = set()
+        # Paths of initial and created files, checked once per scanned file
+        self._known_paths = set()
+        # Index over created_files for O(1) download checks
+        self._created_relative_paths = set()
+        # Directory path -> (mtime_ns, subdirectories) from the last scan
+        self._dir_cache = {}
+        # Records trimmed from the front of created_files so far
+        self._created_files_dropped = 0
+        # (files ever recorded, encoded list) from the last get_created_files_json()
+        self._created_files_json = None
+        # Serializes scans; the flags coalesce background scan requests
+        self._scan_lock = threading.Lock()
+        self._scan_state_lock = threading.Lock()
+        self._scan_in_flight = False
+        self._scan_pending = False
         
         # Expose core manager attributes for compatibility
         self.conversation_manager = self.run_manager.conversation_manager
@@ -65,70 +268,177 @@ class WebSocketRunManager:
         self.execution_manager.execute_function = self._hooked_execute_function
         self.execution_manager.get_next_action = self._hooked_get_next_action
         
+    def close(self):
+        """Restore the core hooks and stop emitting; used once the session is gone"""
+        self.execution_manager.execute_function = self._original_execute_function
+        self.execution_manager.get_next_action = self._original_get_next_action
+        # Nobody is left to receive events still waiting in a batch
+        if isinstance(self.socketio, EmitBatcher) and self.session_id:
+            self.socketio.discard(self.session_id)
+        self.socketio = None
+        
     def _hooked_execute_function(self, function_name: str, function_args: dict):
         """Hooked version of execute_function that emits WebSocket events"""
         # Call the original function
         result, change = self._original_execute_function(function_name, function_args)
         
-        # Emit tool call event
-        self.emit_tool_call(function_name, function_args, str(result))
+        # Emit tool call event; once the session is gone, skip converting
+        # what could be a large result for nobody
+        if self.socketio is None:
+            pass
+        elif isinstance(result, str):
+            self.emit_tool_call(function_name, function_args, result)
+        elif isinstance(result, bytes):
+            self.emit_tool_call(function_name, function_args,
+                                base64.b64encode(result).decode('ascii'), encoding='base64')
+        else:
+            self.emit_tool_call(function_name, function_args, str(result))
         
-        # Scan for new files after tool execution
-        self._scan_for_new_files()
+        # Scan for new files after tool execution without holding up the agent
+        self._schedule_scan()
         
         return result, change
         
     def _hooked_get_next_action(self, conversation_history):
         """Hooked version of get_next_action that emits assistant messages"""
+        # An interrupted tool call leaves messages the LLM API rejects
+        if isinstance(conversation_history, list):
+            _remove_orphaned_tool_messages(conversation_history)
+        
         # Call the original function
         assistant_message = self._original_get_next_action(conversation_history)
         
         # Emit assistant message if there's content
-        if assistant_message and hasattr(assistant_message, 'content') and assistant_message.content:
-            self.emit_assistant_message(assistant_message.content)
-        elif assistant_message and isinstance(assistant_message, dict) and 'content' in assistant_message:
-            self.emit_assistant_message(assistant_message['content'])
+        content = _message_field(assistant_message, 'content')
+        if content:
+            self.emit_assistant_message(content)
             
         return assistant_message
         
+    def handle_print(self, args: tuple):
+        """Emit events for markers in text the core printed during this run"""
+        if not args:
+            return
+        
+        # Most calls print a single string; reuse it instead of copying
+        if len(args) == 1 and isinstance(args[0], str):
+            text = args[0]
+        else:
+            text = ' '.join(str(arg) for arg in args)
+        
+        # One scan finds the markers; the highest-priority one picks the handler
+        markers = PRINT_EVENT_MARKERS.findall(text)
+        if markers:
+            marker = min(markers, key=PRINT_EVENT_PRIORITY.__getitem__)
+            getattr(self, PRINT_EVENT_HANDLERS[marker])(text)
+    
+    def _on_step_marker(self, text: str):
+        """Detect step transitions"""
+        try:
+            # Extract step info: "--- Step 1/10 ---"
+            parts = text.split()
+            step_part = [p for p in parts if '/' in p][0]
+            step, max_steps = map(int, step_part.split('/'))
+            self.emit_step_start(step, max_steps)
+        except:
+            pass  # Ignore parsing errors
+    
+    def _on_task_completed_marker(self, text: str):
+        """Detect task completion"""
+        self.emit_message('task_completed', {
+            'message': 'Task completed successfully',
+            'timestamp': now_iso()
+        })
+    
+    def _on_directory_marker(self, text: str):
+        """Detect directory changes"""
+        self.emit_message('directory_changed', {
+            'directory': text.split("🔄 Changed working directory to: ")[-1],
+            'timestamp': now_iso()
+        })
+    
+    def _on_auto_continue_marker(self, text: str):
+        """Detect auto-continue messages"""
+        self.emit_message('auto_continue', {
+            'message': 'Auto-continuing execution',
+            'timestamp': now_iso()
+        })
+    
+    def _on_warning_marker(self, text: str):
+        """Detect warnings"""
+        self.emit_message('warning', {
+            'message': text,
+            'timestamp': now_iso()
+        })
+    
     def emit_message(self, event: str, data: Dict[str, Any]):
         """Emit a message to the WebSocket client with error handling"""
         try:
             if self.socketio and self.session_id:
                 self.socketio.emit(event, data, room=self.session_id)
         except Exception as e:
-            logger.warning(f"Failed to emit WebSocket event '{event}' to session {self.session_id}: {e}")
+            logger.warning("Failed to emit WebSocket event '%s' to session %s: %s", event, self.session_id, e)
             # Don't re-raise the exception to avoid breaking the agent execution
+            
+    def flush(self):
+        """Send events still held by a batching emitter without waiting for the interval"""
+        if isinstance(self.socketio, EmitBatcher) and self.session_id:
+            self.socketio.flush(self.session_id)
         
     def emit_step_start(self, step: int, max_steps: int):
         """Emit step start event"""
         self.emit_message('step_start', {
             'step': step,
             'max_steps': max_steps,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': now_iso()
         })
         
     def emit_assistant_message(self, content: str):
         """Emit assistant message"""
         self.emit_message('assistant_message', {
             'content': content,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': now_iso()
         })
         
-    def emit_tool_call(self, function_name: str, function_args: dict, result: str):
-        """Emit tool call execution"""
-        self.emit_message('tool_call', {
+    def emit_tool_call(self, function_name: str, function_args: dict, result: str, encoding: str = None):
+        """
+        Emit tool call execution.
+        
+        Results longer than TOOL_RESULT_CHUNK_SIZE are split: the tool_call
+        event carries the first chunk and the total in 'result_chunks', and
+        the rest follow as tool_call_chunk events carrying the same
+        'tool_call_id', their index in 'seq' and the total.
+        """
+        tool_call_id = next(self._tool_call_ids)
+        payload = {
+            'tool_call_id': tool_call_id,
             'function_name': function_name,
             'function_args': function_args,
-            'result': result,
-            'timestamp': datetime.now().isoformat()
-        })
+            'result': result[:TOOL_RESULT_CHUNK_SIZE],
+            'timestamp': now_iso()
+        }
+        if encoding:
+            payload['result_encoding'] = encoding
+        
+        chunk_count = max(1, -(-len(result) // TOOL_RESULT_CHUNK_SIZE))
+        if chunk_count > 1:
+            payload['result_chunks'] = chunk_count
+        self.emit_message('tool_call', payload)
+        
+        for seq in range(1, chunk_count):
+            start = seq * TOOL_RESULT_CHUNK_SIZE
+            self.emit_message('tool_call_chunk', {
+                'tool_call_id': tool_call_id,
+                'seq': seq,
+                'result_chunks': chunk_count,
+                'data': result[start:start + TOOL_RESULT_CHUNK_SIZE]
+            })
         
     def emit_step_summary(self, summary: str):
         """Emit step summary"""
         self.emit_message('step_summary', {
             'summary': summary,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': now_iso()
         })
         
     def emit_waiting_for_input(self, prompt: str):
@@ -136,200 +446,294 @@ class WebSocketRunManager:
         self.waiting_for_input = True
         self.emit_message('waiting_for_input', {
             'prompt': prompt,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': now_iso()
         })
+        # The client must see the prompt before the agent blocks on it
+        self.flush()
         
     def get_user_input(self, prompt: str = "") -> str:
-        """Get user input via WebSocket"""
+        """
+        Get user input via WebSocket.
+        
+        Raises InputCancelled, an EOFError, when the run is stopped before
+        or while waiting, rather than making up an answer the core would
+        take as the user's.
+        """
+        self._input_ready.clear()
+        if self.stop_requested:
+            raise InputCancelled("Agent was stopped before input was given")
         self.emit_waiting_for_input(prompt)
         
         # Wait for user input
-        try:
-            user_input = self.user_input_queue.get(timeout=300)  # 5 minute timeout
-            self.waiting_for_input = False
-            return user_input
-        except queue.Empty:
-            self.waiting_for_input = False
+        received = self._input_ready.wait(timeout=300)  # 5 minute timeout
+        self.waiting_for_input = False
+        if self.stop_requested:
+            self._pending_input = None
+            raise InputCancelled("Agent was stopped while waiting for input")
+        if not received:
             return "n"  # Default to stop if no input received
+        
+        user_input, self._pending_input = self._pending_input, None
+        return user_input
             
     def provide_user_input(self, user_input: str):
         """Provide user input from WebSocket"""
         if self.waiting_for_input:
-            self.user_input_queue.put(user_input)
+            self._pending_input = user_input
+            self._input_ready.set()
+    
+    def cancel_input(self):
+        """Wake a pending get_user_input() after a stop request; it raises InputCancelled"""
+        self._input_ready.set()
             
     def run(self, user_instruction: str, max_steps: int = 10, auto_continue: int = 0):
         """
         Enhanced run method with WebSocket integration.
         This wraps the core RunManager's run method with WebSocket events.
-        """
-        # Reset stop flag
-        self.stop_requested = False
         
+        stop_requested is not reset here: each run gets a new run manager,
+        and a stop that arrived before run() was called must still count.
+        """
         # Emit start event
         self.emit_message('agent_started', {
             'instruction': user_instruction,
             'max_steps': max_steps,
             'auto_continue': auto_continue,
             'output_dir': self.output_dir,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': now_iso()
         })
         
         try:
-            # Hook into the core run manager's print statements to emit WebSocket events
-            # We'll need to patch the input function to use our WebSocket input
-            import builtins
-            original_input = builtins.input
-            original_print = builtins.print
-            
-            def websocket_input(prompt=""):
-                """Replace input() calls with WebSocket input"""
-                return self.get_user_input(prompt)
-                
-            def websocket_print(*args, **kwargs):
-                """Capture print statements and optionally emit them"""
-                # Call original print
-                original_print(*args, **kwargs)
-                
-                # Parse print content for specific events
-                if args:
-                    text = ' '.join(str(arg) for arg in args)
-                    
-                    # Detect step transitions
-                    if "--- Step" in text:
-                        try:
-                            # Extract step info: "--- Step 1/10 ---"
-                            parts = text.split()
-                            step_part = [p for p in parts if '/' in p][0]
-                            step, max_steps = map(int, step_part.split('/'))
-                            self.emit_step_start(step, max_steps)
-                        except:
-                            pass  # Ignore parsing errors
-                            
-                    # Detect task completion
-                    elif "✅ Task completed" in text:
-                        self.emit_message('task_completed', {
-                            'message': 'Task completed successfully',
-                            'timestamp': datetime.now().isoformat()
-                        })
-                        
-                    # Detect directory changes
-                    elif "🔄 Changed working directory to:" in text:
-                        self.emit_message('directory_changed', {
-                            'directory': text.split("🔄 Changed working directory to: ")[-1],
-                            'timestamp': datetime.now().isoformat()
-                        })
-                        
-                    # Detect auto-continue messages
-                    elif "🔄 Auto-continuing" in text:
-                        self.emit_message('auto_continue', {
-                            'message': 'Auto-continuing execution',
-                            'timestamp': datetime.now().isoformat()
-                        })
-                        
-                    # Detect warnings
-                    elif "⚠️" in text:
-                        self.emit_message('warning', {
-                            'message': text,
-                            'timestamp': datetime.now().isoformat()
-                        })
-            
-            # Patch built-in functions
-            builtins.input = websocket_input
-            builtins.print = websocket_print
+            # Route the core's print() and input() calls on this thread to
+            # this run manager
+            _install_builtin_hooks()
+            previous_run = getattr(_current_run, 'manager', None)
+            _current_run.manager = self
+            _active_runs.add(self)
             
             try:
                 # Call the core run manager's run method
                 # This will handle all the prompting, conversation management, etc.
-                self.run_manager.run(user_instruction, max_steps, auto_continue)
+                try:
+                    self.run_manager.run(user_instruction, max_steps, auto_continue)
+                except InputCancelled:
+                    # A stop interrupted a prompt; report it like any other stop
+                    logger.info("Agent in session %s stopped while waiting for input", self.session_id)
+                
+                # Report files from the last tool calls before the final event
+                self._scan_for_new_files()
                 
                 # Check if we were stopped externally
                 if self.stop_requested:
                     self.emit_message('agent_stopped', {
                         'message': 'Agent was stopped by user or external request',
-                        'timestamp': datetime.now().isoformat()
+                        'timestamp': now_iso()
                     })
                 else:
                     self.emit_message('agent_finished', {
                         'message': 'Agent execution completed',
-                        'timestamp': datetime.now().isoformat()
+                        'timestamp': now_iso()
                     })
                     
             finally:
-                # Restore original functions
-                builtins.input = original_input
-                builtins.print = original_print
+                _current_run.manager = previous_run
+                _active_runs.discard(self)
                 
         except Exception as e:
             self.emit_message('execution_error', {
                 'error': str(e),
-                'timestamp': datetime.now().isoformat()
+                'timestamp': now_iso()
             })
             raise
+        finally:
+            # Deliver the final events of the run immediately
+            self.flush()
 
     def _scan_initial_files(self):
         """Scan the output directory for initial files"""
-        import os
         try:
             if os.path.exists(self.output_dir):
-                for root, dirs, files in os.walk(self.output_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
+                # Also seeds the directory cache for later scans
+                for _, files in self._iter_changed_dirs(self.output_dir):
+                    for entry in files:
+                        file_path = entry.path
                         self.initial_files.add(file_path)
+                        self._known_paths.add(file_path)
         except Exception as e:
+            self._dir_cache.clear()
             logger.warning(f"Failed to scan initial files: {e}")
     
+    def _iter_changed_dirs(self, path: str):
+        """
+        Yield (directory, file DirEntry objects) for each directory under
+        path whose listing may have changed since the last scan.
+        
+        Adding or removing an entry updates a directory's mtime, so a
+        directory whose mtime matches the cached value is not listed again;
+        its subdirectories are still visited.
+        """
+        mtime_ns = os.stat(path).st_mtime_ns
+        cached = self._dir_cache.get(path)
+        if cached is not None and cached[0] == mtime_ns:
+            subdirs = cached[1]
+        else:
+            subdirs = []
+            files = []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        # Like os.walk, do not descend into symlinked directories
+                        if not entry.is_symlink():
+                            subdirs.append(entry.path)
+                    else:
+                        files.append(entry)
+            
+            # Only trust the mtime of directories that have been quiet for a
+            # while; coarse timestamps can hide a change made in the same tick
+            if time.time_ns() - mtime_ns > DIR_CACHE_MIN_AGE_NS:
+                self._dir_cache[path] = (mtime_ns, subdirs)
+            yield path, files
+        
+        for subdir in subdirs:
+            yield from self._iter_changed_dirs(subdir)
+    
+    def _schedule_scan(self):
+        """Scan for new files in a background task, coalescing requests made while one runs"""
+        socketio = self.socketio
+        if socketio is None:
+            return
+        
+        with self._scan_state_lock:
+            if self._scan_in_flight:
+                self._scan_pending = True
+                return
+            self._scan_in_flight = True
+        
+        try:
+            socketio.start_background_task(self._background_scan)
+        except Exception:
+            with self._scan_state_lock:
+                self._scan_in_flight = False
+            raise
+    
+    def _background_scan(self):
+        """Scan until no further scan was requested in the meantime"""
+        while True:
+            socketio = self.socketio
+            if socketio is not None:
+                socketio.sleep(SCAN_DEBOUNCE_SECONDS)
+            self._scan_for_new_files()
+            with self._scan_state_lock:
+                if not self._scan_pending:
+                    self._scan_in_flight = False
+                    return
+                self._scan_pending = False
+    
     def _scan_for_new_files(self):
         """Scan for new files created since initialization"""
-        import os
+        with self._scan_lock:
+            return self._scan_for_new_files_locked()
+    
+    def _scan_for_new_files_locked(self):
+        """Scan for new files; caller must hold the scan lock"""
         new_files = []
+        output_prefix = os.path.join(self.output_dir, '')
         try:
             if os.path.exists(self.output_dir):
-                for root, dirs, files in os.walk(self.output_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        if file_path not in self.initial_files and file_path not in [f['path'] for f in self.created_files]:
-                            # Get file info
-                            stat = os.stat(file_path)
-                            relative_path = os.path.relpath(file_path, self.output_dir)
+                for _, files in self._iter_changed_dirs(self.output_dir):
+                    for entry in files:
+                        file_path = entry.path
+                        if file_path not in self._known_paths:
+                            # Get file info; cached on the entry where the
+                            # platform's directory listing includes it
+                            stat = entry.stat()
+                            # Walked paths start with output_dir, so slicing off the
+                            # prefix gives the same result as os.path.relpath
+                            if file_path.startswith(output_prefix):
+                                relative_path = file_path[len(output_prefix):]
+                            else:
+                                relative_path = os.path.relpath(file_path, self.output_dir)
                             
                             file_info = {
                                 'path': file_path,
                                 'relative_path': relative_path,
-                                'name': file,
+                                'name': entry.name,
                                 'size': stat.st_size,
-                                'created': datetime.fromtimestamp(stat.st_ctime).isoformat(),
-                                'modified': datetime.fromtimestamp(stat.st_mtime).isoformat()
+                                'created': iso_from_ns(stat.st_ctime_ns),
+                                'modified': iso_from_ns(stat.st_mtime_ns)
                             }
                             
                             new_files.append(file_info)
                             self.created_files.append(file_info)
+                            self._known_paths.add(file_path)
+                            self._created_relative_paths.add(relative_path)
                             
                             # Emit file creation event
                             self.emit_file_created(file_info)
                             
+            # Bound the records kept for a long run
+            excess = len(self.created_files) - MAX_TRACKED_FILES
+            if excess > 0:
+                del self.created_files[:excess]
+                self._created_files_dropped += excess
+            
         except Exception as e:
+            # A partial scan may have cached directories whose files were
+            # not all recorded; list everything again next time
+            self._dir_cache.clear()
             logger.warning(f"Failed to scan for new files: {e}")
             
         return new_files
     
     def emit_file_created(self, file_info: dict):
         """Emit file creation event with only the required fields"""
-        # Build the minimal file object
-        file_payload = {
-            'name': file_info.get('name'),
-            'size': file_info.get('size'),
-            'created': file_info.get('created'),
-            'modified': file_info.get('modified')
-        }
-        # Always include at least name and size
-        if not file_payload['name'] or file_payload['size'] is None:
-            # Do not emit if required fields are missing
+        # Always include at least name and size; do not emit without them
+        name = file_info.get('name')
+        size = file_info.get('size')
+        if not name or size is None:
             return
+        
+        # Build the minimal file object straight into the event
         self.emit_message('file_created', {
-            'file': file_payload,
+            'file': {
+                'name': name,
+                'size': size,
+                'created': file_info.get('created'),
+                'modified': file_info.get('modified')
+            },
             'session_id': self.session_id
         })
     
     def get_created_files(self):
         """Get list of all created files"""
-        return self.created_files.copy() 
\ No newline at end of file
+        return self.created_files.copy()
+    
+    def get_created_files_since(self, since: int = 0):
+        """
+        Get the files recorded after the first ``since`` and the cursor for
+        the next call.
+        
+        The cursor counts every file ever recorded, including records
+        trimmed from created_files, so it stays valid across trims.
+        """
+        dropped = self._created_files_dropped
+        files = self.created_files[max(since - dropped, 0):]
+        return files, dropped + len(self.created_files)
+    
+    def get_created_files_json(self):
+        """
+        Get the created files as a JSON array string and its length.
+        
+        The number of files ever recorded identifies the encoded list, so
+        repeated polls reuse the cached string.
+        """
+        files = self.created_files[:]
+        version = self._created_files_dropped + len(files)
+        cached = self._created_files_json
+        if cached is None or cached[0] != version:
+            cached = self._created_files_json = (version, json_codec.dumps(files), len(files))
+        return cached[1], cached[2]
+    
+    def is_created_file(self, relative_path: str) -> bool:
+        """Check whether the agent created the file at relative_path"""
+        return relative_path in self._created_relative_paths 
\ No newline at end of file
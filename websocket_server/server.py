@@ -5,112 +5,331 @@ Main server module that initializes and runs the SimpleAgent WebSocket server.
 """
 
 import os
+import time
+import signal
+import socket
 import logging
+import threading
+from contextlib import contextmanager
 from flask import Flask
 from flask_socketio import SocketIO
 
+from . import json_codec
 from .core_loader import core_loader
-from .event_handlers import register_handlers
+from .emit_batcher import EmitBatcher
+from .event_handlers import register_handlers, get_session_manager, agent_pool
 from .routes import api_bp
 
 logger = logging.getLogger(__name__)
 
+# Longest wait for the tools to release their resources on shutdown
+CLEANUP_TIMEOUT = float(os.environ.get('CLEANUP_TIMEOUT', 10))
+
+
+def detect_async_mode():
+    """
+    Pick the Socket.IO async mode matching how the process was monkey patched.
+    
+    SOCKETIO_ASYNC_MODE overrides the detection.
+    """
+    forced = os.environ.get('SOCKETIO_ASYNC_MODE')
+    if forced:
+        return forced
+    
+    try:
+        from eventlet.patcher import is_monkey_patched
+    except ImportError:
+        pass
+    else:
+        if is_monkey_patched('socket'):
+            return 'eventlet'
+    
+    try:
+        from gevent.monkey import is_module_patched
+    except ImportError:
+        pass
+    else:
+        if is_module_patched('socket'):
+            return 'gevent'
+    
+    return 'threading'
+
 
 class SimpleAgentWebSocketServer:
     """Main WebSocket server class"""
     
-    def __init__(self, host='localhost', port=5000, debug=False):
+    def __init__(self, host='localhost', port=5000, debug=False, batch_ms=0, batch_max=140,
+                 tcp_nodelay=True, sndbuf=None, rcvbuf=None, reuse_port=False, uds_path=None,
+                 max_http_buffer_size=1000000, use_reloader=False, ping_interval=25,
+                 ping_timeout=60):
         self.host = host
         self.port = port
         self.debug = debug
+        self.batch_ms = batch_ms
+        self.batch_max = batch_max
+        self.tcp_nodelay = tcp_nodelay
+        self.sndbuf = sndbuf
+        self.rcvbuf = rcvbuf
+        self.reuse_port = reuse_port
+        self.uds_path = uds_path
+        self.max_http_buffer_size = max_http_buffer_size
+        self.use_reloader = use_reloader
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.core = None
         self.app = None
         self.socketio = None
+        self.emitter = None
+        self._shutting_down = False
+        self.startup_timings = {}
+        
+    @contextmanager
+    def _timed(self, phase):
+        """Record how long a startup phase takes, in milliseconds"""
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.startup_timings[phase] = (time.perf_counter_ns() - start) / 1e6
+            
+    def _log_startup_timings(self):
+        """Log startup phases, slowest first"""
+        total = sum(self.startup_timings.values())
+        lines = [f"Startup took {total:.1f} ms:"]
+        for phase, elapsed in sorted(self.startup_timings.items(), key=lambda item: -item[1]):
+            lines.append(f"  {phase:<16} {elapsed:>10.1f} ms")
+        logger.info("\n".join(lines))
         
     def initialize(self, eager_loading=False):
         """Initialize the server"""
-        # Setup logging
-        logging.basicConfig(
-            level=logging.INFO, 
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
+        # Handlers are set up by app.configure_logging(); only quiet httpx here
         logging.getLogger("httpx").setLevel(logging.WARNING)
         
         # Setup core path and load modules
         if not core_loader.setup_core_path():
             return False
             
-        core = core_loader.load_core_modules()
-        core_loader.validate_configuration()
+        with self._timed('core_modules'):
+            self.core = core_loader.load_core_modules()
+            core_loader.validate_configuration()
         
         # Initialize commands based on user preference
-        commands = core['commands']
+        commands = self.core.commands
         dynamic_loading = not eager_loading
-        print(f"🔧 Initializing tools with {'dynamic' if dynamic_loading else 'eager'} loading...")
-        commands.init(dynamic=dynamic_loading)
+        logger.info("🔧 Initializing tools with %s loading...", 'dynamic' if dynamic_loading else 'eager')
+        with self._timed('tools'):
+            commands.init(dynamic=dynamic_loading)
+        
+        with self._timed('flask_socketio'):
+            self._create_app()
         
+        self._log_startup_timings()
+        logger.info("Server initialized successfully")
+        return True
+        
+    def _create_app(self):
+        """Create the Flask app and SocketIO server and register handlers"""
         # Initialize Flask app
         self.app = Flask(__name__)
         self.app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'simple-agent-websocket-secret')
+        self.app.json = json_codec.JSONProvider(self.app)  # orjson when available
+        
+        # Let a fronting web server send downloaded files (Apache/lighttpd
+        # X-Sendfile, or an nginx internal location mapped to output/)
+        self.app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '0') == '1'
+        self.app.config['X_ACCEL_REDIRECT_PREFIX'] = os.environ.get('X_ACCEL_REDIRECT_PREFIX')
         
         # Initialize SocketIO
         self.socketio = SocketIO(
             self.app, 
             cors_allowed_origins="*", 
-            async_mode='threading',
+            async_mode=detect_async_mode(),
             logger=False,  # Disable verbose logging to reduce noise
             engineio_logger=False,  # Disable engine.io logging
-            ping_timeout=60,  # Increase ping timeout
-            ping_interval=25,  # Ping interval
-            max_http_buffer_size=1000000  # Increase buffer size
+            ping_timeout=self.ping_timeout,  # Seconds without a pong before disconnecting
+            ping_interval=self.ping_interval,  # Seconds between server pings
+            max_http_buffer_size=self.max_http_buffer_size,  # Largest accepted message
+            json=json_codec,  # orjson when available
+            # e.g. redis://localhost:6379/0, to share emits across processes
+            message_queue=os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None
         )
         
         # Register routes
         self.app.register_blueprint(api_bp)
         
+        # Coalesce agent events into batched frames when enabled
+        if self.batch_ms > 0:
+            self.emitter = EmitBatcher(self.socketio, self.batch_ms, self.batch_max)
+        else:
+            self.emitter = self.socketio
+        
         # Register WebSocket event handlers
-        register_handlers(self.socketio)
+        register_handlers(self.socketio, self.emitter)
         
-        logger.info("Server initialized successfully")
-        return True
+    def tune_socket(self, sock):
+        """Apply TCP_NODELAY and buffer size options to a socket"""
+        if self.tcp_nodelay:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        if self.rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
         
     def run(self):
         """Run the server"""
         if not self.app or not self.socketio:
             raise RuntimeError("Server not initialized. Call initialize() first.")
             
-        # Load core modules for version info
-        core = core_loader.load_core_modules()
-        AGENT_VERSION = core['AGENT_VERSION']
-        API_PROVIDER = core['API_PROVIDER']
+        # Version info from the core modules loaded by initialize()
+        AGENT_VERSION = self.core.AGENT_VERSION
+        API_PROVIDER = self.core.API_PROVIDER
         
         try:
-            print(f"🚀 Starting Simple-Agent-Websocket Server...")
-            print(f"📡 Server will be available at: http://{self.host}:{self.port}")
-            print(f"🔌 WebSocket endpoint: ws://{self.host}:{self.port}/socket.io/")
-            print(f"🏥 Health check: http://{self.host}:{self.port}/health")
-            print(f"📊 Sessions endpoint: http://{self.host}:{self.port}/sessions")
-            print(f"📋 Version endpoint: http://{self.host}:{self.port}/version")
-            print(f"🤖 Agent version: {AGENT_VERSION}")
-            print(f"🔗 API provider: {API_PROVIDER}")
-            print(f"💬 Features: Real-time step updates, bidirectional communication")
-            print(f"📦 Core: SimpleAgent from git submodule")
+            # Written in one call; SIMPLE_AGENT_QUIET=1 suppresses it
+            if os.environ.get('SIMPLE_AGENT_QUIET', '0') != '1':
+                banner = ["🚀 Starting Simple-Agent-Websocket Server..."]
+                if self.uds_path:
+                    # Nothing listens on host:port; the proxy in front has the URLs
+                    banner.append(f"🧦 Listening on Unix socket: {self.uds_path}")
+                else:
+                    banner += [
+                        f"📡 Server will be available at: http://{self.host}:{self.port}",
+                        f"🔌 WebSocket endpoint: ws://{self.host}:{self.port}/socket.io/",
+                        f"🏥 Health check: http://{self.host}:{self.port}/health",
+                        f"📊 Sessions endpoint: http://{self.host}:{self.port}/sessions",
+                        f"📋 Version endpoint: http://{self.host}:{self.port}/version",
+                    ]
+                banner += [
+                    f"🤖 Agent version: {AGENT_VERSION}",
+                    f"🔗 API provider: {API_PROVIDER}",
+                    "💬 Features: Real-time step updates, bidirectional communication",
+                    "📦 Core: SimpleAgent from git submodule",
+                ]
+                print("\n".join(banner), flush=True)
             
             # Start the server
-            self.socketio.run(
-                self.app,
-                host=self.host,
-                port=self.port,
-                debug=self.debug,
-                use_reloader=False,  # Disable reloader to prevent issues with threading
-                allow_unsafe_werkzeug=True  # Allow running in production environments
-            )
+            if self.socketio.async_mode == 'eventlet':
+                if self.use_reloader:
+                    logger.warning("The reloader is only available in threading mode; ignoring it")
+                self._run_eventlet()
+            else:
+                self.socketio.run(
+                    self.app,
+                    host=self.host,
+                    port=self.port,
+                    debug=self.debug,
+                    use_reloader=self.use_reloader,  # Off unless requested; it re-stats every module
+                    allow_unsafe_werkzeug=True,  # Allow running in production environments
+                    request_handler=self._make_request_handler()  # Socket options per connection
+                )
         finally:
-            # Clean up tool manager resources
-            core = core_loader.load_core_modules()
-            commands = core['commands']
-            commands.cleanup()
+            self.cleanup()
+    
+    def cleanup(self):
+        """Stop agent runs and release tool resources"""
+        # Stop agent runs so pool workers can exit with the process
+        get_session_manager().stop_all()
+        agent_pool.shutdown(wait=False, cancel_futures=True)
+        
+        # Clean up tool manager resources; a tool stuck in teardown must
+        # not hold up the exit (e.g. a rolling deploy)
+        if self.core is not None:
+            cleaner = self._native_thread_class()(target=self.core.commands.cleanup,
+                                                  name='tool-cleanup', daemon=True)
+            cleaner.start()
+            cleaner.join(CLEANUP_TIMEOUT)
+            if cleaner.is_alive():
+                logger.warning("Tool cleanup still running after %ss; exiting anyway", CLEANUP_TIMEOUT)
+            
+    def _native_thread_class(self):
+        """
+        Return threading.Thread as it was before monkey patching.
+        
+        A green thread stuck in a call that does not yield holds the hub, so
+        a join timeout on it would never fire; an OS thread can be abandoned.
+        """
+        async_mode = self.socketio.async_mode if self.socketio else 'threading'
+        if async_mode == 'eventlet':
+            from eventlet.patcher import original
+            return original('threading').Thread
+        if async_mode == 'gevent':
+            from gevent.monkey import get_original
+            return get_original('threading', 'Thread')
+        return threading.Thread
+        
+    def _make_request_handler(self):
+        """Werkzeug request handler that applies the socket options to each connection"""
+        from werkzeug.serving import WSGIRequestHandler
+        
+        server = self
+        
+        class TunedRequestHandler(WSGIRequestHandler):
+            def setup(self):
+                # StreamRequestHandler.setup() assigns self.connection
+                super().setup()
+                server.tune_socket(self.connection)
+        
+        return TunedRequestHandler
+        
+    def shutdown(self, drain_timeout=0):
+        """
+        Stop the server gracefully.
+        
+        Waits up to drain_timeout seconds for running agents to finish,
+        flushes any batched emits, then interrupts the serving loop so that
+        run() returns through its cleanup path. Safe to call from a signal
+        handler.
+        """
+        if self._shutting_down:
+            return
+        self._shutting_down = True
+        
+        logger.info(f"Shutting down (draining for up to {drain_timeout}s)")
+        self.socketio.start_background_task(self._drain_and_stop, drain_timeout)
+        
+    def _drain_and_stop(self, drain_timeout):
+        """Wait for running agents, flush pending emits and stop serving"""
+        session_manager = get_session_manager()
+        deadline = time.monotonic() + drain_timeout
+        
+        while time.monotonic() < deadline and any(
+            session['is_running'] for session in session_manager.list_sessions()
+        ):
+            self.socketio.sleep(0.1)
+        
+        if isinstance(self.emitter, EmitBatcher):
+            self.emitter.flush_all()
+        
+        # Both serving loops exit on KeyboardInterrupt in the main thread
+        os.kill(os.getpid(), signal.SIGINT)
+        
+    def _run_eventlet(self):
+        """
+        Serve with eventlet on a listening socket we create ourselves.
+        
+        Equivalent to socketio.run() in eventlet mode, but lets the socket
+        options be applied. Accepted connections inherit them from the
+        listening socket. With reuse_port, several processes can listen on
+        the same port and the kernel spreads new connections across them.
+        With uds_path, the server listens on a Unix domain socket instead,
+        for a reverse proxy on the same host.
+        """
+        import eventlet
+        import eventlet.wsgi
+        
+        if self.uds_path:
+            if os.path.exists(self.uds_path):
+                os.unlink(self.uds_path)
+            listener = eventlet.listen(self.uds_path, family=socket.AF_UNIX)
+            os.chmod(self.uds_path, 0o660)
+        else:
+            listener = eventlet.listen((self.host, self.port), reuse_port=self.reuse_port)
+            self.tune_socket(listener)
+        self.app.debug = self.debug
+        eventlet.wsgi.server(listener, self.app, log_output=self.debug)
 
 
-def create_server(host='localhost', port=5000, debug=False):
+def create_server(host='localhost', port=5000, **options):
     """Factory function to create a server instance"""
-    return SimpleAgentWebSocketServer(host=host, port=port, debug=debug) 
\ No newline at end of file
+    return SimpleAgentWebSocketServer(host=host, port=port, **options)
+ 
\ No newline at end of file
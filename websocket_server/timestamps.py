@@ -0,0 +1,55 @@
+"""
+Timestamps
+
+Cached ISO-8601 timestamps for WebSocket event payloads. Events emitted in
+the same burst share one formatted timestamp instead of each calling
+datetime.now().isoformat(). Timestamps formatted within the same second
+share the formatted date and time of day.
+"""
+
+import time
+
+# Events within this window reuse the same timestamp string
+TIMESTAMP_RESOLUTION_NS = 5_000_000
+
+# (monotonic_ns, iso_string) of the last formatted timestamp
+_cache = (-TIMESTAMP_RESOLUTION_NS, '')
+
+# (whole seconds, 'YYYY-MM-DDTHH:MM:SS') of the last formatted file time
+_second_cache = (None, '')
+
+
+def now_iso() -> str:
+    """Return the current local time in ISO format, cached for a few milliseconds"""
+    global _cache
+    
+    now = time.monotonic_ns()
+    cached_at, cached = _cache
+    if now - cached_at < TIMESTAMP_RESOLUTION_NS:
+        return cached
+    
+    # Same format as datetime.now().isoformat(), reusing the formatted second
+    cached = iso_from_ns(time.time_ns())
+    # A single tuple assignment keeps readers from seeing a torn update
+    _cache = (now, cached)
+    return cached
+
+
+def iso_from_ns(timestamp_ns: int) -> str:
+    """
+    Format a POSIX timestamp in nanoseconds (e.g. st_mtime_ns) as local time
+    in ISO format, like datetime.fromtimestamp(...).isoformat() but with
+    the fraction truncated to whole microseconds.
+    """
+    global _second_cache
+    
+    seconds, nanoseconds = divmod(timestamp_ns, 1_000_000_000)
+    cached_second, prefix = _second_cache
+    if seconds != cached_second:
+        prefix = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(seconds))
+        _second_cache = (seconds, prefix)
+    
+    microseconds = nanoseconds // 1000
+    if microseconds:
+        return f"{prefix}.{microseconds:06d}"
+    return prefix
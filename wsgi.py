@@ -0,0 +1,9 @@
+"""
+Simple-Agent-Websocket WSGI Entry Point
+
+Builds the Flask app for production WSGI servers, e.g. ``gunicorn wsgi:app``.
+"""
+
+from app import create_app
+
+app = create_app()